@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # APEACH KoBERT LoRA 학습 루프
+#
+# `로라 실험 1. APPEACH KoBERT (LoRA) R값 하이퍼파라미터 튜닝.ipynb`의 학습/평가 루프를 함수로 옮긴 모듈입니다.
+# R 값 스윕과 레이어별 스윕(sweep.py)이 같은 학습 코드를 사용합니다.
+
+import contextlib
+
+import torch
+from torch.optim import AdamW
+from transformers import get_scheduler
+
+import distributed
+import token_cache
+from metrics import ConfusionMatrixAccumulator
+
+model_name = "monologg/kobert"
+dataset_name = "jason9693/APEACH"
+
+# 하이퍼파라미터 기본값 (노트북과 동일)
+batch_size = 8
+learning_rate = 5e-5
+num_epochs = 5
+
+# LoRA를 적용할 수 있는 모듈(레이어) 종류
+supported_modules = (torch.nn.Linear, torch.nn.Embedding, torch.nn.Conv2d, torch.nn.Conv1d)
+
+
+def get_device():
+    return torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+
+
+# 모델에서 지원하는 모듈(레이어) 이름 리스트 (R 값 스윕에서 사용)
+def supported_module_names(model):
+    return [name for name, module in model.named_modules() if isinstance(module, supported_modules)]
+
+
+# 모든 Linear(Dense) 레이어 이름 리스트 (레이어별 스윕에서 사용)
+def dense_layer_names(model):
+    return [name for name, module in model.named_modules() if isinstance(module, torch.nn.Linear)]
+
+
+# APEACH를 토크나이즈 캐시(token_cache)에서 읽습니다. 처음 한 번만 실제로 토크나이즈합니다.
+def load_tokenized(tokenizer, dataset=None, cache_dir="./token_cache", max_length=None):
+    from datasets import load_dataset
+
+    dataset = dataset if dataset is not None else load_dataset(dataset_name)
+    return token_cache.load_or_build(cache_dir, dataset_name, dataset, tokenizer, text_column="text",
+                                     label_column="class", max_length=max_length)
+
+
+# LoRA 설정을 적용하고, 분류기(classifier) 파라미터는 학습 가능하도록 설정합니다.
+def build_lora_model(model, r, lora_alpha=32, target_modules=None, lora_dropout=0.1, task_type=None):
+    from peft import LoraConfig, get_peft_model
+
+    config = LoraConfig(
+        r=r,  # LoRA rank 값 (훈련 파라미터 크기 조절)
+        lora_alpha=lora_alpha,  # 스케일링 파라미터
+        target_modules=target_modules or supported_module_names(model),  # LoRA를 적용할 대상 모듈 이름들
+        lora_dropout=lora_dropout,  # 드롭아웃 확률 (오버피팅 방지)
+        bias="none",  # bias 파라미터 학습 여부 설정
+        task_type=task_type
+    )
+    model = get_peft_model(model, config)
+    for param in model.classifier.parameters():
+        param.requires_grad = True
+    return model
+
+
+# profiler(profiling.StepProfiler)가 주어지면 스텝마다 tokenize(배치 가져오기) / forward / backward / optimizer / metric
+# 시간을 기록합니다.
+def run_epoch(model, dataloader, device, accumulator, optimizer=None, lr_scheduler=None, autocast_dtype=None,
+              profiler=None):
+    phase = profiler.phase if profiler is not None else (lambda name: contextlib.nullcontext())
+    accumulator.reset()
+    batches = iter(dataloader)
+    while True:
+        with phase("tokenize"):
+            batch = next(batches, None)
+            if batch is not None:
+                batch = {k: v.to(device) for k, v in batch.items()}
+        if batch is None:
+            break
+        if optimizer is not None:
+            with phase("forward"), torch.autocast(device.type, dtype=autocast_dtype or torch.bfloat16,
+                                                  enabled=autocast_dtype is not None):
+                outputs = model(**batch)
+            with phase("backward"):
+                outputs.loss.backward()
+            with phase("optimizer"):
+                # 데이터 병렬 학습이면 학습되는 파라미터의 그래디언트를 rank끼리 평균냅니다. (단일 프로세스에서는 아무것도 안 함)
+                distributed.allreduce_gradients(model)
+                optimizer.step()
+                lr_scheduler.step()
+                optimizer.zero_grad()
+        else:
+            with phase("forward"), torch.no_grad(), torch.autocast(device.type, dtype=autocast_dtype or torch.bfloat16,
+                                                                   enabled=autocast_dtype is not None):
+                outputs = model(**batch)
+        # 손실과 예측은 디바이스 위에서 누적하고, 에포크 끝에 한 번만 호스트로 가져옵니다.
+        with phase("metric"):
+            accumulator.update(outputs.logits, batch["labels"], outputs.loss)
+        if profiler is not None:
+            profiler.end_step(tokens=int(batch["attention_mask"].sum()), samples=len(batch["labels"]))
+    accumulator.all_reduce()
+    return accumulator.compute()
+
+
+# 학습 및 평가를 num_epochs 만큼 반복하고, 에포크별 지표를 담은 history를 돌려줍니다.
+# history 예시: {"train_f1": [...], "eval_f1": [...], "eval_loss": [...], ...}
+# report가 주어지면 매 에포크 평가 후 report(epoch, history)를 호출하고, False를 돌려주면 학습을 조기 종료합니다.
+# autocast_dtype(예: cpu_training.prepare_cpu_training()의 반환값 torch.bfloat16)을 주면 순전파를 autocast로 실행합니다.
+# torch.distributed가 초기화되어 있으면 rank별로 데이터를 나눠 데이터 병렬로 학습합니다. (distributed.py 참고)
+# profiler(profiling.StepProfiler)를 주면 학습 스텝의 단계별 시간을 기록합니다.
+def train_and_evaluate(model, splits, num_epochs=num_epochs, batch_size=batch_size,
+                       learning_rate=learning_rate, device=None, verbose=True, report=None, autocast_dtype=None,
+                       profiler=None):
+    device = device or get_device()
+    model.to(device)
+    rank, world_size = distributed.world_info()
+    distributed.broadcast_trainable(model)
+
+    # 길이가 비슷한 샘플끼리 배치를 만들어 패딩을 줄입니다.
+    train_dataloader = token_cache.make_dataloader(splits["train"], batch_size, shuffle=True,
+                                                   num_replicas=world_size, rank=rank, drop_uneven=True)
+    eval_dataloader = token_cache.make_dataloader(splits["test"], batch_size, shuffle=False,
+                                                  num_replicas=world_size, rank=rank)
+
+    # 옵티마이저와 학습률 스케줄러 설정
+    optimizer = AdamW(model.parameters(), lr=learning_rate)
+    num_training_steps = num_epochs * len(train_dataloader)
+    lr_scheduler = get_scheduler(
+        name="linear", optimizer=optimizer, num_warmup_steps=0, num_training_steps=num_training_steps
+    )
+
+    # 지표 누적기는 한 번만 만들고 에포크마다 초기화해 재사용합니다.
+    accumulator = ConfusionMatrixAccumulator(num_classes=2, device=device)
+    history = {}
+    for epoch in range(num_epochs):
+        for split, dataloader in [("train", train_dataloader), ("eval", eval_dataloader)]:
+            if split == "train":
+                model.train()
+                epoch_metrics = run_epoch(model, dataloader, device, accumulator, optimizer, lr_scheduler,
+                                          autocast_dtype, profiler)
+            else:
+                model.eval()
+                epoch_metrics = run_epoch(model, dataloader, device, accumulator, autocast_dtype=autocast_dtype)
+
+            for name, value in epoch_metrics.items():
+                history.setdefault(f"{split}_{name}", []).append(value)
+            if verbose:
+                print(f"Epoch {epoch+1}/{num_epochs} - {split.capitalize()} Loss: {epoch_metrics['loss']}, "
+                      f"Accuracy: {epoch_metrics['accuracy']}, F1: {epoch_metrics['f1']}, "
+                      f"Precision: {epoch_metrics['precision']}, Recall: {epoch_metrics['recall']}")
+
+        if report is not None and not report(epoch + 1, history):
+            break
+    return history
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 비동기 successive halving(ASHA) LoRA 하이퍼파라미터 탐색
+#
+# 노트북의 R 값 스윕과 레이어별 스윕은 모든 설정을 `num_epochs = 5` 끝까지 학습합니다.
+# 여기서는 r, lora_alpha, lora_dropout, target_modules, learning_rate 공간에서 설정을 샘플링해
+# sweep.py의 프로세스 풀로 실행하고, 각 트라이얼이 rung 에포크(예: 1, 2, 4)에 도달할 때마다
+# 지금까지 같은 rung에 도달한 트라이얼 중 상위 1/eta에 들지 못하면 바로 멈춥니다.
+# 다른 트라이얼을 기다리지 않으므로(asynchronous) 워커가 놀지 않습니다.
+#
+# 실행 예시:
+#
+#     python asha.py --num-trials 24 --workers 3
+#     python asha.py --num-trials 12 --workers 3 --benchmark   # 전체 학습(exhaustive)과 비교
+
+import argparse
+import math
+import multiprocessing
+import random
+import time
+
+import apeach_lora
+import sweep
+
+# 탐색 공간 (target_modules=None은 노트북처럼 지원되는 모든 모듈에 적용)
+search_space = {
+    "r": [4, 8, 16, 32, 64, 128],
+    "lora_alpha": [8, 16, 32, 64],
+    "lora_dropout": [0.0, 0.05, 0.1, 0.2],
+    "target_modules": [None, ["query", "value"], ["query", "key", "value"], ["query", "key", "value", "dense"]],
+    "learning_rate": (1e-5, 1e-3),  # 로그 균등 분포
+}
+
+
+def sample_configs(num_trials, seed=0, space=search_space):
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(num_trials):
+        low, high = space["learning_rate"]
+        configs.append({
+            "r": rng.choice(space["r"]),
+            "lora_alpha": rng.choice(space["lora_alpha"]),
+            "lora_dropout": rng.choice(space["lora_dropout"]),
+            "target_modules": rng.choice(space["target_modules"]),
+            "learning_rate": round(math.exp(rng.uniform(math.log(low), math.log(high))), 7),
+        })
+    return configs
+
+
+class AshaScheduler:
+    # rung 점수는 Manager dict에 저장되어 모든 워커 프로세스가 공유합니다.
+    def __init__(self, manager, max_epochs=apeach_lora.num_epochs, min_epochs=1, eta=2, metric="eval_f1"):
+        self.rungs = []
+        epoch = min_epochs
+        while epoch < max_epochs:
+            self.rungs.append(epoch)
+            epoch *= eta
+        self.eta = eta
+        self.metric = metric
+        self.scores = manager.dict()
+        self.lock = manager.Lock()
+
+    # 이미 저장된 결과(재개한 스윕)로 rung 점수를 다시 채웁니다.
+    def restore(self, results):
+        for result in results.values():
+            values = result["history"].get(self.metric, [])
+            for rung in self.rungs:
+                if rung <= len(values):
+                    self.scores[(rung, result["trial_id"])] = values[rung - 1]
+
+    def should_continue(self, trial_id, epoch, history):
+        if epoch not in self.rungs:
+            return True
+        score = history[self.metric][-1]
+        with self.lock:
+            self.scores[(epoch, trial_id)] = score
+            rung_scores = sorted((v for (rung, _), v in self.scores.items() if rung == epoch), reverse=True)
+        # 비교 대상이 eta개 미만이면 판단을 미루고 계속 진행합니다.
+        if len(rung_scores) < self.eta:
+            return True
+        cutoff = rung_scores[max(0, len(rung_scores) // self.eta - 1)]
+        return score >= cutoff
+
+
+# 완료 순서대로 누적 CPU 시간과 그때까지의 최고 점수를 출력합니다.
+def report_anytime(label, results):
+    ordered = sorted(results.values(), key=lambda result: result["finished_at"])
+    cpu_time, best = 0.0, None
+    print(f"[{label}] 누적 CPU 시간 대비 최고 검증 F1")
+    for result in ordered:
+        cpu_time += result["cpu_time"]
+        if best is None or result["best_eval_f1"] > best["best_eval_f1"]:
+            best = result
+        print(f"  cpu {cpu_time:8.0f}s  best F1 {best['best_eval_f1']:.4f}  ({best['trial_id']})")
+    print(f"[{label}] 최고 설정: {best['config']}")
+    return cpu_time, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-trials", type=int, default=24)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-trial", type=int, default=None)
+    parser.add_argument("--num-epochs", type=int, default=apeach_lora.num_epochs)
+    parser.add_argument("--eta", type=int, default=2)
+    parser.add_argument("--cpu-mode", action="store_true")
+    parser.add_argument("--cache-dir", default="./sweep_cache")
+    parser.add_argument("--results-dir", default="./sweep_results/asha")
+    parser.add_argument("--benchmark", action="store_true")
+    args = parser.parse_args()
+
+    sweep.prepare_shared(args.cache_dir)
+    trials = sample_configs(args.num_trials, args.seed)
+    train_args = {"num_epochs": args.num_epochs, "cpu_mode": args.cpu_mode}
+
+    with multiprocessing.get_context("spawn").Manager() as manager:
+        scheduler = AshaScheduler(manager, max_epochs=args.num_epochs, eta=args.eta)
+        scheduler.restore(sweep.load_results(args.results_dir))
+        start = time.perf_counter()
+        results = sweep.run_sweep(trials, args.cache_dir, args.results_dir, args.workers, args.threads_per_trial,
+                                  train_args, scheduler)
+        asha_wall = time.perf_counter() - start
+    asha_cpu, asha_best = report_anytime("ASHA", results)
+
+    if args.benchmark:
+        # 같은 설정들을 조기 종료 없이 끝까지 학습해 비교합니다.
+        start = time.perf_counter()
+        full_results = sweep.run_sweep(trials, args.cache_dir, args.results_dir + "_exhaustive", args.workers,
+                                       args.threads_per_trial, train_args)
+        full_wall = time.perf_counter() - start
+        full_cpu, full_best = report_anytime("exhaustive", full_results)
+        print(f"벽시계 시간: ASHA {asha_wall:.0f}s vs exhaustive {full_wall:.0f}s "
+              f"({full_wall / max(asha_wall, 1e-9):.2f}x), CPU 시간: {asha_cpu:.0f}s vs {full_cpu:.0f}s")
+        print(f"최고 검증 F1: ASHA {asha_best['best_eval_f1']:.4f} vs exhaustive {full_best['best_eval_f1']:.4f}")
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 오프라인 LoRA 학습 / 추론 벤치마크 스위트 (회귀 추적)
+#
+# 무작위로 초기화한 작은 Bloom / BERT 설정과 합성 텍스트, 합성 어휘로 만든 토크나이저를 쓰므로 허브 접근 없이
+# 같은 결과 형식으로 재현할 수 있습니다. 케이스마다 profiling.StepProfiler로 단계별 시간, LoRA / 고정 레이어별
+# forward 시간, 토큰/초, 최대 RSS를 재고 JSON으로 저장합니다.
+# 최대 RSS는 프로세스 전체 값이므로 케이스는 한 번 실행할 때마다 별도 프로세스에서 돌립니다. 케이스마다 --repeats번
+# 반복해 각 지표의 중앙값을 기록하고, 반복 간 값(samples)도 함께 저장합니다.
+#
+# - bert_lora_train: APEACH 루프(apeach_lora.run_epoch)로 분류 LoRA 학습. 토크나이즈는 배치마다 collate에서 합니다.
+# - bloom_lora_train: causal LM LoRA 학습 (Bloom 스크립트와 같은 query_key_value 대상)
+# - bloom_lora_generate: get_outputs()로 생성
+#
+# --baseline 파일이 있으면 중앙값끼리 비교해, 처리량이 허용 오차보다 줄거나 시간 / 메모리가 허용 오차보다 늘어난 항목을
+# 회귀로 표시하고 종료 코드 1로 끝냅니다. 허용 오차는 지표마다 기준선과 이번 결과의 반복 간 상대 범위((최대 - 최소) / 중앙값)
+# 중 큰 값에 --spread-factor를 곱한 값이며, --tolerance보다 작아지지는 않습니다. --save-baseline은 이번 결과를 기준선으로
+# 저장합니다.
+# (기준선은 같은 머신, 같은 스레드 수에서 만든 것과 비교해야 의미가 있습니다.)
+#
+# 실행 예시:
+#
+#     python benchmark_suite.py --save-baseline
+#     python benchmark_suite.py --r 16 --bloom-target-modules query_key_value dense   # 기준선 대비 비교
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import torch
+
+import apeach_lora
+from metrics import ConfusionMatrixAccumulator
+from profiling import StepProfiler, profile_generation
+
+# (지표 경로, 높을수록 좋은지)
+tracked_metrics = [
+    ("tokens_per_sec", True),
+    ("samples_per_sec", True),
+    ("step_ms_median", False),
+    ("peak_rss_mb", False),
+]
+
+
+def synthetic_texts(num_texts, vocab_words=500, min_words=4, max_words=60, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(f"w{rng.randrange(vocab_words)}" for _ in range(rng.randint(min_words, max_words)))
+            for _ in range(num_texts)]
+
+
+# 합성 단어(w0 ~ w{n-1})용 WordLevel 토크나이저
+def tiny_tokenizer(vocab_words=500):
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    specials = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "</s>"]
+    vocab = {token: index for index, token in enumerate(specials + [f"w{i}" for i in range(vocab_words)])}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    return PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="[PAD]", unk_token="[UNK]",
+                                   cls_token="[CLS]", sep_token="[SEP]", eos_token="</s>")
+
+
+def tiny_bert(tokenizer, seed=0):
+    from transformers import BertConfig, BertForSequenceClassification
+
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=len(tokenizer), hidden_size=64, num_hidden_layers=2, num_attention_heads=4,
+                        intermediate_size=128, max_position_embeddings=128, num_labels=2,
+                        pad_token_id=tokenizer.pad_token_id)
+    return BertForSequenceClassification(config)
+
+
+def tiny_bloom(tokenizer, seed=0):
+    from transformers import BloomConfig, BloomForCausalLM
+
+    torch.manual_seed(seed)
+    config = BloomConfig(vocab_size=len(tokenizer), hidden_size=64, n_layer=2, n_head=4,
+                         pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id,
+                         bos_token_id=tokenizer.eos_token_id)
+    return BloomForCausalLM(config)
+
+
+# Bloom 스크립트와 같은 LoRA 설정 (r, target_modules만 바꿀 수 있음)
+def bloom_lora_model(tokenizer, r, target_modules):
+    from peft import LoraConfig, get_peft_model
+
+    config = LoraConfig(r=r, lora_alpha=1, target_modules=target_modules, lora_dropout=0.05, bias="lora_only",
+                        task_type="CAUSAL_LM")
+    return get_peft_model(tiny_bloom(tokenizer), config)
+
+
+def bert_lora_train(tokenizer, args):
+    model = apeach_lora.build_lora_model(tiny_bert(tokenizer), r=args.r, target_modules=args.bert_target_modules)
+    texts = synthetic_texts(args.num_samples)
+    labels = [len(text) % 2 for text in texts]
+
+    # 노트북처럼 배치마다 토크나이즈합니다.
+    def collate(indices):
+        batch = tokenizer([texts[i] for i in indices], padding=True, truncation=True, max_length=128,
+                          return_tensors="pt")
+        return {"input_ids": batch["input_ids"], "attention_mask": batch["attention_mask"],
+                "labels": torch.tensor([labels[i] for i in indices])}
+
+    dataloader = torch.utils.data.DataLoader(range(len(texts)), batch_size=args.batch_size, collate_fn=collate)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=apeach_lora.learning_rate)
+    lr_scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lambda step: 1.0)
+    profiler = StepProfiler(model, warmup=args.warmup)
+    model.train()
+    apeach_lora.run_epoch(model, dataloader, torch.device("cpu"), ConfusionMatrixAccumulator(), optimizer,
+                          lr_scheduler, profiler=profiler)
+    return profiler
+
+
+def bloom_lora_train(tokenizer, args):
+    from transformers import DataCollatorForLanguageModeling
+
+    model = bloom_lora_model(tokenizer, args.r, args.bloom_target_modules)
+    texts = synthetic_texts(args.num_samples, seed=1)
+    collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=3e-4)
+    profiler = StepProfiler(model, warmup=args.warmup)
+    model.train()
+    for start in range(0, len(texts), args.batch_size):
+        with profiler.phase("tokenize"):
+            batch = collator([tokenizer(text) for text in texts[start:start + args.batch_size]])
+        with profiler.phase("forward"):
+            loss = model(**batch).loss
+        with profiler.phase("backward"):
+            loss.backward()
+        with profiler.phase("optimizer"):
+            optimizer.step()
+            optimizer.zero_grad()
+        profiler.end_step(tokens=int(batch["attention_mask"].sum()), samples=len(batch["input_ids"]))
+    return profiler
+
+
+def bloom_lora_generate(tokenizer, args):
+    model = bloom_lora_model(tokenizer, args.r, args.bloom_target_modules).eval()
+    prompts = synthetic_texts(args.num_prompts, max_words=20, seed=2)
+    return profile_generation(model, tokenizer, prompts, args.max_new_tokens,
+                              StepProfiler(model, warmup=args.warmup))
+
+
+cases = {
+    "bert_lora_train": bert_lora_train,
+    "bloom_lora_train": bloom_lora_train,
+    "bloom_lora_generate": bloom_lora_generate,
+}
+
+
+# 자식 프로세스에서 케이스를 한 번 실행합니다.
+def run_case(name, args):
+    torch.manual_seed(0)
+    profiler = cases[name](tiny_tokenizer(), args)
+    profiler.close()
+    print(f"[{name}] {profiler}", file=sys.stderr)
+    return profiler.summary()
+
+
+def case_command(name, args):
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", name, "--r", str(args.r),
+               "--bloom-target-modules", *args.bloom_target_modules, "--num-samples", str(args.num_samples),
+               "--batch-size", str(args.batch_size), "--num-prompts", str(args.num_prompts),
+               "--max-new-tokens", str(args.max_new_tokens), "--warmup", str(args.warmup)]
+    if args.bert_target_modules:
+        command += ["--bert-target-modules", *args.bert_target_modules]
+    if args.threads:
+        command += ["--threads", str(args.threads)]
+    return command
+
+
+# 반복 간 상대 범위: (최대 - 최소) / 중앙값. 반복 값이 없으면 0입니다.
+def relative_spread(values):
+    if values is None or len(values) < 2:
+        return 0.0
+    median = statistics.median(values)
+    return (max(values) - min(values)) / abs(median) if median else 0.0
+
+
+# 반복 실행 결과를 합칩니다. 추적 지표와 단계별 시간은 중앙값을 쓰고, 반복마다의 값은 samples에 남깁니다.
+# (모듈별 시간 등 나머지 항목은 스텝 중앙값이 가운데인 실행의 값을 씁니다.)
+def aggregate_runs(runs):
+    samples = {metric: [run[metric] for run in runs] for metric, _ in tracked_metrics}
+    for phase in runs[0]["phase_ms"]:
+        samples[f"phase_ms.{phase}"] = [run["phase_ms"].get(phase, 0.0) for run in runs]
+
+    result = dict(sorted(runs, key=lambda run: run["step_ms_median"])[len(runs) // 2])
+    for metric, _ in tracked_metrics:
+        result[metric] = statistics.median(samples[metric])
+    result["phase_ms"] = {phase: statistics.median(samples[f"phase_ms.{phase}"]) for phase in runs[0]["phase_ms"]}
+    result["repeats"] = len(runs)
+    result["samples"] = samples
+    return result
+
+
+def run_suite(args):
+    results = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "threads": args.threads or torch.get_num_threads(),
+            "args": {key: value for key, value in vars(args).items()
+                     if key not in ("output", "baseline", "save_baseline", "tolerance", "spread_factor", "run_case")},
+        },
+        "cases": {},
+    }
+    for name in args.cases:
+        runs = []
+        for _ in range(args.repeats):
+            output = subprocess.run(case_command(name, args), capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        result = aggregate_runs(runs)
+        results["cases"][name] = result
+        print(f"[{name}] 반복 {result['repeats']}회 중앙값: 스텝 {result['step_ms_median']:.1f}ms, "
+              f"토큰/초 {result['tokens_per_sec']:.0f} (범위 {relative_spread(result['samples']['tokens_per_sec']):.1%}), "
+              f"최대 RSS {result['peak_rss_mb']:.0f}MB")
+    return results
+
+
+# 기준선과 비교해 회귀 항목 목록을 돌려줍니다. 단계별 시간(phase_ms)도 늘어나면 회귀로 봅니다.
+# (기준선에서 min_phase_ms보다 짧은 단계는 측정 잡음이 커서 비교하지 않습니다.)
+# 지표마다 허용 오차는 max(tolerance, spread_factor * 기준선 / 이번 결과의 반복 간 상대 범위 중 큰 값)입니다.
+def find_regressions(results, baseline, tolerance=0.05, spread_factor=1.0, min_phase_ms=1.0):
+    regressions = []
+    for name, current in results["cases"].items():
+        reference = baseline["cases"].get(name)
+        if reference is None:
+            continue
+        metrics = list(tracked_metrics)
+        metrics += [(("phase_ms", phase), False) for phase in reference.get("phase_ms", {})
+                    if reference["phase_ms"][phase] >= min_phase_ms]
+        for metric, higher_is_better in metrics:
+            if isinstance(metric, tuple):
+                old, new = reference[metric[0]][metric[1]], current[metric[0]].get(metric[1], 0.0)
+                metric = ".".join(metric)
+            else:
+                old, new = reference[metric], current[metric]
+            if not old:
+                continue
+            noise = max(relative_spread(reference.get("samples", {}).get(metric)),
+                        relative_spread(current.get("samples", {}).get(metric)))
+            threshold = max(tolerance, spread_factor * noise)
+            change = (new - old) / old
+            if (change < -threshold) if higher_is_better else (change > threshold):
+                regressions.append({"case": name, "metric": metric, "baseline": old, "current": new,
+                                    "change": change, "threshold": threshold})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", nargs="+", choices=list(cases), default=list(cases))
+    parser.add_argument("--r", type=int, default=4)
+    parser.add_argument("--bert-target-modules", nargs="+", default=None)
+    parser.add_argument("--bloom-target-modules", nargs="+", default=["query_key_value"])
+    parser.add_argument("--num-samples", type=int, default=384)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--num-prompts", type=int, default=24)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", default="./benchmark_results/latest.json")
+    parser.add_argument("--baseline", default="./benchmark_results/baseline.json")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--spread-factor", type=float, default=1.0)
+    # 내부용: 케이스 하나를 이 프로세스에서 실행하고 요약을 JSON 한 줄로 출력합니다.
+    parser.add_argument("--run-case", choices=list(cases), default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.run_case is not None:
+        print(json.dumps(run_case(args.run_case, args)))
+        sys.exit(0)
+
+    results = run_suite(args)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"결과 저장: {args.output}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"기준선 저장: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance, args.spread_factor)
+        for item in regressions:
+            print(f"회귀: [{item['case']}] {item['metric']} {item['baseline']:.2f} -> {item['current']:.2f} "
+                  f"({item['change']:+.1%}, 허용 오차 {item['threshold']:.1%})")
+        if regressions:
+            sys.exit(1)
+        print(f"기준선({args.baseline}) 대비 회귀 없음 (최소 허용 오차 {args.tolerance:.0%}, "
+              f"반복 간 범위 x {args.spread_factor})")
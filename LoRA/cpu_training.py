@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # CPU 전용 LoRA 학습 모드
+#
+# 학습 서버에는 GPU가 없는데, 두 스크립트는 기본 fp32에 `use_cpu=False`, `auto_find_batch_size=True`로 학습합니다.
+# 이 모듈은 Trainer 경로(Bloom)와 직접 작성한 APEACH 루프 모두에서 사용할 수 있는 CPU 학습 설정을 제공합니다.
+#
+# - bf16 autocast (`torch.autocast("cpu", dtype=torch.bfloat16)`)
+# - 고정된 기본 모델에 gradient checkpointing 적용 (use_reentrant=False라 입력에 requires_grad가 필요 없음)
+# - LoRA Linear forward 융합: 기본 `query_key_value` / `Linear` 출력 버퍼에 저랭크 항을 addmm_으로 바로 누적해
+#   PEFT 기본 forward의 중간 텐서(lora_B 출력, scaling 곱, 덧셈 결과)를 만들지 않습니다.
+# - 물리 코어 수에 맞춘 intra-op / inter-op 스레드 설정
+#
+# 벤치마크 (모드별로 별도 프로세스에서 실행해 최대 RSS를 따로 잽니다):
+#
+#     python cpu_training.py --model monologg/kobert --steps 50
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import types
+
+import torch
+
+
+# /proc/cpuinfo의 (physical id, core id) 쌍으로 물리 코어 수를 셉니다. 현재 프로세스에 허용된 코어 수를 넘지 않습니다.
+# 두 값이 없는 프로세서 블록(ARM, 일부 VM)이 있으면 물리 코어를 알 수 없으므로 허용된 코어 수를 그대로 씁니다.
+def physical_core_count():
+    allowed = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    cores = set()
+    try:
+        with open("/proc/cpuinfo") as f:
+            blocks = f.read().split("\n\n")
+    except OSError:
+        return allowed
+    for block in blocks:
+        fields = dict(line.split(":", 1) for line in block.splitlines() if ":" in line)
+        fields = {key.strip(): value.strip() for key, value in fields.items()}
+        if "processor" not in fields:
+            continue
+        if "physical id" not in fields or "core id" not in fields:
+            return allowed
+        cores.add((fields["physical id"], fields["core id"]))
+    return min(allowed, len(cores)) if cores else allowed
+
+
+def cpu_supports_bf16():
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+# intra-op 스레드는 물리 코어 수, inter-op 스레드는 1~2개로 둡니다.
+# (inter-op 스레드 수는 병렬 작업이 시작되기 전에만 바꿀 수 있습니다.)
+def configure_cpu_threads(num_threads=None, num_interop_threads=None):
+    num_threads = num_threads or physical_core_count()
+    num_interop_threads = num_interop_threads or min(2, num_threads)
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(num_interop_threads)
+    except RuntimeError:
+        pass
+    return num_threads, num_interop_threads
+
+
+def _fused_lora_linear_forward(self, x, *args, **kwargs):
+    active = self.active_adapters
+    if (self.disable_adapters or self.merged or args or kwargs or len(active) != 1
+            or active[0] not in self.lora_A or active[0] in getattr(self, "lora_variant", {})
+            or getattr(self, "use_dora", {}).get(active[0], False)
+            or self.lora_B[active[0]].bias is not None):
+        return self._unfused_forward(x, *args, **kwargs)
+
+    name = active[0]
+    base = self.base_layer
+    x2d = x.reshape(-1, x.shape[-1])
+    # 기본 Linear: bias + x @ W^T 를 한 번의 addmm으로 계산합니다.
+    if base.bias is not None:
+        out = torch.addmm(base.bias, x2d, base.weight.t())
+    else:
+        out = x2d @ base.weight.t()
+    # 저랭크 항을 출력 버퍼에 바로 누적합니다: out += scaling * (dropout(x) @ A^T) @ B^T
+    xa = self.lora_dropout[name](x2d) @ self.lora_A[name].weight.t()
+    out.addmm_(xa.to(out.dtype), self.lora_B[name].weight.t().to(out.dtype), alpha=self.scaling[name])
+    return out.view(*x.shape[:-1], out.shape[-1])
+
+
+# PEFT LoRA Linear 레이어의 forward를 융합 버전으로 바꿉니다. 모듈 구조와 state_dict 키는 그대로라
+# save_pretrained 결과는 달라지지 않습니다. 융합할 수 없는 경우(병합됨, 여러 어댑터, DoRA 등)는 원래 forward로 돌아갑니다.
+def fuse_lora_linears(model):
+    from peft.tuners.lora import Linear as LoraLinear
+
+    fused = 0
+    for module in model.modules():
+        if isinstance(module, LoraLinear) and isinstance(module.base_layer, torch.nn.Linear):
+            if not hasattr(module, "_unfused_forward"):
+                module._unfused_forward = module.forward
+                module.forward = types.MethodType(_fused_lora_linear_forward, module)
+                fused += 1
+    return fused
+
+
+def enable_gradient_checkpointing(peft_model):
+    base_model = peft_model.get_base_model() if hasattr(peft_model, "get_base_model") else peft_model
+    base_model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+    base_model.config.use_cache = False
+
+
+# PEFT 모델을 CPU 학습용으로 준비합니다. 반환값은 APEACH 루프에 넘길 autocast dtype입니다.
+def prepare_cpu_training(peft_model, bf16=None, gradient_checkpointing=True, fuse=True, num_threads=None):
+    configure_cpu_threads(num_threads)
+    if gradient_checkpointing:
+        enable_gradient_checkpointing(peft_model)
+    if fuse:
+        fuse_lora_linears(peft_model)
+    bf16 = cpu_supports_bf16() if bf16 is None else bf16
+    return torch.bfloat16 if bf16 else None
+
+
+# Bloom 스크립트의 TrainingArguments를 CPU 학습용으로 만듭니다.
+# auto_find_batch_size 대신 고정 배치 크기를 쓰고, bf16 autocast와 gradient checkpointing을 켭니다.
+def cpu_training_arguments(output_dir, per_device_train_batch_size=8, bf16=None, **kwargs):
+    from transformers import TrainingArguments
+
+    return TrainingArguments(
+        output_dir=output_dir,
+        per_device_train_batch_size=per_device_train_batch_size,
+        use_cpu=True,
+        bf16=cpu_supports_bf16() if bf16 is None else bf16,
+        gradient_checkpointing=True,
+        gradient_checkpointing_kwargs={"use_reentrant": False},
+        dataloader_num_workers=0,
+        **kwargs
+    )
+
+
+def peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# APEACH 분류 모델로 학습 스텝 처리량을 잽니다. (모드 하나만 실행, 결과는 JSON 한 줄로 출력)
+def run_benchmark_mode(model_name, mode, steps, batch_size, seq_len):
+    from transformers import AutoModelForSequenceClassification
+
+    import apeach_lora
+
+    if mode == "cpu":
+        configure_cpu_threads()
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, num_labels=2)
+    model = apeach_lora.build_lora_model(model, r=8, target_modules=apeach_lora.dense_layer_names(model))
+    autocast_dtype = prepare_cpu_training(model) if mode == "cpu" else None
+
+    vocab_size = model.config.vocab_size
+    batch = {
+        "input_ids": torch.randint(5, vocab_size, (batch_size, seq_len)),
+        "attention_mask": torch.ones(batch_size, seq_len, dtype=torch.long),
+        "labels": torch.randint(0, 2, (batch_size,)),
+    }
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=5e-5)
+    model.train()
+
+    def train_step():
+        with torch.autocast("cpu", dtype=autocast_dtype or torch.bfloat16, enabled=autocast_dtype is not None):
+            loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    train_step()
+    start = time.perf_counter()
+    for _ in range(steps):
+        train_step()
+    elapsed = time.perf_counter() - start
+    return {"mode": mode, "samples_per_sec": steps * batch_size / elapsed, "peak_rss_mb": peak_rss_bytes() / 1024 ** 2,
+            "threads": torch.get_num_threads(), "bf16": autocast_dtype is not None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="monologg/kobert")
+    parser.add_argument("--mode", choices=["fp32", "cpu"], default=None)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seq-len", type=int, default=128)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run_benchmark_mode(args.model, args.mode, args.steps, args.batch_size, args.seq_len)))
+    else:
+        for mode in ["fp32", "cpu"]:
+            output = subprocess.run(
+                [sys.executable, __file__, "--model", args.model, "--mode", mode, "--steps", str(args.steps),
+                 "--batch-size", str(args.batch_size), "--seq-len", str(args.seq_len)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"[{mode}] samples/sec: {result['samples_per_sec']:.1f}, 최대 RSS: {result['peak_rss_mb']:.0f}MB, "
+                  f"스레드: {result['threads']}, bf16: {result['bf16']}")
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 멀티 프로세스 데이터 병렬 CPU 학습 (torch.distributed, gloo)
+#
+# 두 학습 경로(Bloom Trainer, APEACH 루프)는 한 프로세스에서만 돌기 때문에 코어가 많은 CPU 노드가 대부분 놉니다.
+# 이 모듈은 torchrun으로 띄운 로컬 프로세스(여러 CPU 노드도 가능)끼리 gloo 백엔드로 데이터 병렬 학습을 합니다.
+#
+# - 고정된 기본 모델은 그대로 두고, 학습되는 LoRA / classifier 파라미터의 그래디언트만 하나의 평탄화된 버퍼로
+#   모아 스텝마다 all-reduce 한 번으로 평균냅니다. (기본 모델에 비해 아주 작음)
+# - 데이터로더는 rank마다 서로 다른 배치를 받습니다. (token_cache.make_dataloader의 num_replicas / rank)
+# - 체크포인트는 rank 0만 save_pretrained로 한 번 쓰고, 나머지 rank는 barrier에서 기다립니다.
+# - 각 rank는 허용된 코어를 나눠 가지고 그 코어에만 고정됩니다. (물리 코어 순서로 나눠 한 소켓 안에 모이도록)
+#
+# apeach_lora.train_and_evaluate()는 분산 초기화가 되어 있으면 위 처리를 자동으로 합니다. (배치 크기는 rank당 크기)
+#
+# Bloom 스크립트(Trainer)는 torchrun으로 실행하면 Trainer가 DDP로 감쌉니다. DDP도 requires_grad인 파라미터의
+# 그래디언트만 all-reduce하므로 LoRA 파라미터만 통신합니다. 저장은 rank 0에서만 합니다.
+#
+#     training_args = distributed_training_arguments(output_directory, learning_rate=3e-2, num_train_epochs=3)
+#     trainer = Trainer(model=peft_model, args=training_args, ...)
+#     trainer.train()
+#     save_pretrained_once(trainer.model, peft_model_path)
+#
+# 실행 예시:
+#
+#     torchrun --nproc_per_node 4 distributed.py apeach --r 8 --output-dir ./apeach_lora_ddp
+#     torchrun --nnodes 2 --node_rank 0 --master_addr 10.0.0.1 --nproc_per_node 2 distributed.py apeach --r 8
+#     python distributed.py benchmark --world-sizes 1 2 4   # samples/sec 스케일링 벤치마크
+
+import argparse
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+
+import cpu_training
+
+
+# torchrun이 설정한 환경 변수(RANK, WORLD_SIZE, MASTER_ADDR, ...)로 프로세스 그룹을 만듭니다.
+# WORLD_SIZE가 없거나 1이면 초기화하지 않고 단일 프로세스로 동작합니다. 반환값은 (rank, world_size)입니다.
+def init_distributed(backend="gloo"):
+    if int(os.environ.get("WORLD_SIZE", "1")) > 1 and not dist.is_initialized():
+        dist.init_process_group(backend)
+    return world_info()
+
+
+def world_info():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+def is_main_process():
+    return world_info()[0] == 0
+
+
+def barrier():
+    if world_info()[1] > 1:
+        dist.barrier()
+
+
+# /proc/cpuinfo 기준으로 (physical id, core id) 순서로 정렬한 허용 CPU 목록 (하이퍼스레드 형제끼리 붙어 있음)
+def ordered_cpus():
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    topology = {}
+    try:
+        with open("/proc/cpuinfo") as f:
+            processor = physical_id = None
+            for line in f:
+                key, _, value = line.partition(":")
+                key, value = key.strip(), value.strip()
+                if key == "processor":
+                    processor = int(value)
+                elif key == "physical id":
+                    physical_id = int(value)
+                elif key == "core id":
+                    topology[processor] = (physical_id or 0, int(value))
+    except OSError:
+        pass
+    return sorted(allowed, key=lambda cpu: (*topology.get(cpu, (0, cpu)), cpu))
+
+
+def socket_count():
+    sockets = set()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("physical id"):
+                    sockets.add(line.split(":")[1].strip())
+    except OSError:
+        pass
+    return max(1, len(sockets))
+
+
+# 같은 노드의 rank끼리 코어를 나눠 고정하고, 스레드 수를 맞춥니다.
+def pin_local_rank(local_rank=None, local_world_size=None):
+    local_rank = int(os.environ.get("LOCAL_RANK", 0)) if local_rank is None else local_rank
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", 1)) if local_world_size is None else local_world_size
+    cpus = ordered_cpus()
+    # 고정하기 전에 세야 노드 전체의 물리 코어 수가 나옵니다.
+    node_physical_cores = cpu_training.physical_core_count()
+    per_rank = max(1, len(cpus) // local_world_size)
+    cores = cpus[local_rank * per_rank:(local_rank + 1) * per_rank] or cpus
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    # 하이퍼스레드를 빼고 물리 코어 수만큼만 intra-op 스레드를 씁니다.
+    physical_cores = max(1, min(len(cores), node_physical_cores // local_world_size))
+    cpu_training.configure_cpu_threads(physical_cores, 1)
+    return cores
+
+
+def trainable_parameters(model):
+    return [param for param in model.parameters() if param.requires_grad]
+
+
+# 학습되는 파라미터(LoRA A는 무작위 초기화, classifier 등)를 rank 0 값으로 맞춥니다.
+@torch.no_grad()
+def broadcast_trainable(model, src=0):
+    if world_info()[1] == 1:
+        return
+    params = trainable_parameters(model)
+    flat = torch._utils._flatten_dense_tensors([param.data for param in params])
+    dist.broadcast(flat, src)
+    for param, value in zip(params, torch._utils._unflatten_dense_tensors(flat, params)):
+        param.data.copy_(value)
+
+
+# backward 후, optimizer.step() 전에 호출합니다. 학습되는 파라미터의 그래디언트를 한 버퍼로 모아 평균냅니다.
+@torch.no_grad()
+def allreduce_gradients(model):
+    world_size = world_info()[1]
+    if world_size == 1:
+        return
+    params = [param for param in trainable_parameters(model) if param.grad is not None]
+    grads = [param.grad for param in params]
+    flat = torch._utils._flatten_dense_tensors(grads)
+    dist.all_reduce(flat)
+    flat /= world_size
+    for grad, value in zip(grads, torch._utils._unflatten_dense_tensors(flat, grads)):
+        grad.copy_(value)
+
+
+# rank 0만 save_pretrained를 호출하고, 다른 rank는 저장이 끝날 때까지 기다립니다.
+def save_pretrained_once(model, path, **kwargs):
+    if is_main_process():
+        model.save_pretrained(path, **kwargs)
+    barrier()
+
+
+# Bloom 스크립트의 TrainingArguments를 gloo DDP + CPU 학습용으로 만듭니다.
+def distributed_training_arguments(output_dir, **kwargs):
+    return cpu_training.cpu_training_arguments(output_dir, ddp_backend="gloo", ddp_find_unused_parameters=False,
+                                               **kwargs)
+
+
+# torchrun으로 실행한 각 rank에서 APEACH LoRA 모델을 학습하고, rank 0만 어댑터를 저장합니다.
+def train_apeach(r, output_dir, num_epochs, batch_size, learning_rate, cache_dir, cpu_mode):
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    import apeach_lora
+
+    rank, world_size = init_distributed()
+    pin_local_rank()
+    tokenizer = AutoTokenizer.from_pretrained(apeach_lora.model_name)
+    # 토크나이즈 캐시는 rank 0이 먼저 만들고, 나머지 rank는 만들어진 캐시를 읽습니다.
+    if rank == 0:
+        splits = apeach_lora.load_tokenized(tokenizer, cache_dir=cache_dir)
+    barrier()
+    if rank != 0:
+        splits = apeach_lora.load_tokenized(tokenizer, cache_dir=cache_dir)
+
+    torch.manual_seed(0)
+    model = AutoModelForSequenceClassification.from_pretrained(apeach_lora.model_name, num_labels=2)
+    model = apeach_lora.build_lora_model(model, r=r)
+    autocast_dtype = None
+    if cpu_mode:
+        autocast_dtype = cpu_training.prepare_cpu_training(model, num_threads=torch.get_num_threads())
+
+    start = time.perf_counter()
+    history = apeach_lora.train_and_evaluate(model, splits, num_epochs, batch_size, learning_rate,
+                                             device=torch.device("cpu"), verbose=rank == 0,
+                                             autocast_dtype=autocast_dtype)
+    elapsed = time.perf_counter() - start
+    save_pretrained_once(model, output_dir)
+    if rank == 0:
+        samples = len(splits["train"]) * len(history["train_loss"])
+        print(f"world size {world_size}: 학습+평가 {elapsed:.0f}s, {samples / elapsed:.1f} 학습 samples/sec (평가 포함), "
+              f"최종 eval F1 {history['eval_f1'][-1]:.4f}")
+    return history
+
+
+# 스케일링 벤치마크의 rank 하나: 무작위 배치로 학습 스텝 처리량을 잽니다.
+def _benchmark_rank(rank, world_size, port, model_name, steps, batch_size, seq_len, results):
+    from transformers import AutoModelForSequenceClassification
+
+    import apeach_lora
+
+    os.environ.update({"MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(port), "RANK": str(rank),
+                       "WORLD_SIZE": str(world_size), "LOCAL_RANK": str(rank), "LOCAL_WORLD_SIZE": str(world_size)})
+    init_distributed()
+    pin_local_rank()
+    torch.manual_seed(0)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, num_labels=2)
+    model = apeach_lora.build_lora_model(model, r=8, target_modules=apeach_lora.dense_layer_names(model))
+    broadcast_trainable(model)
+    optimizer = torch.optim.AdamW(trainable_parameters(model), lr=5e-5)
+    model.train()
+
+    generator = torch.Generator().manual_seed(rank)
+    batch = {
+        "input_ids": torch.randint(5, model.config.vocab_size, (batch_size, seq_len), generator=generator),
+        "attention_mask": torch.ones(batch_size, seq_len, dtype=torch.long),
+        "labels": torch.randint(0, 2, (batch_size,), generator=generator),
+    }
+
+    def train_step():
+        model(**batch).loss.backward()
+        allreduce_gradients(model)
+        optimizer.step()
+        optimizer.zero_grad()
+
+    train_step()
+    barrier()
+    start = time.perf_counter()
+    for _ in range(steps):
+        train_step()
+    barrier()
+    elapsed = time.perf_counter() - start
+    if rank == 0:
+        results.put({"world_size": world_size, "samples_per_sec": world_size * steps * batch_size / elapsed,
+                     "threads_per_rank": torch.get_num_threads(),
+                     "allreduce_mb": sum(p.numel() * p.element_size() for p in trainable_parameters(model)) / 2 ** 20})
+    if world_size > 1:
+        dist.destroy_process_group()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_scaling_benchmark(model_name, world_sizes, steps, batch_size, seq_len):
+    import torch.multiprocessing as mp
+
+    context = mp.get_context("spawn")
+    rows = []
+    for world_size in world_sizes:
+        results = context.SimpleQueue()
+        mp.spawn(_benchmark_rank, args=(world_size, _free_port(), model_name, steps, batch_size, seq_len, results),
+                 nprocs=world_size)
+        rows.append(results.get())
+    base = rows[0]["samples_per_sec"] / rows[0]["world_size"]
+    print(f"소켓 {socket_count()}개, 물리 코어 {cpu_training.physical_core_count()}개, CPU {len(ordered_cpus())}개")
+    for row in rows:
+        efficiency = row["samples_per_sec"] / (base * row["world_size"])
+        print(f"[world {row['world_size']}] samples/sec: {row['samples_per_sec']:.1f}, "
+              f"스케일링 효율: {efficiency:.0%}, rank당 스레드: {row['threads_per_rank']}, "
+              f"스텝당 all-reduce: {row['allreduce_mb']:.2f}MB")
+    return rows
+
+
+if __name__ == "__main__":
+    import apeach_lora
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    apeach = subparsers.add_parser("apeach")
+    apeach.add_argument("--r", type=int, default=8)
+    apeach.add_argument("--num-epochs", type=int, default=apeach_lora.num_epochs)
+    apeach.add_argument("--batch-size", type=int, default=apeach_lora.batch_size)
+    apeach.add_argument("--learning-rate", type=float, default=apeach_lora.learning_rate)
+    apeach.add_argument("--cache-dir", default="./token_cache")
+    apeach.add_argument("--output-dir", default="./apeach_lora_ddp")
+    apeach.add_argument("--cpu-mode", action="store_true")
+
+    benchmark = subparsers.add_parser("benchmark")
+    benchmark.add_argument("--model", default=apeach_lora.model_name)
+    benchmark.add_argument("--world-sizes", type=int, nargs="+", default=[1, 2, 4])
+    benchmark.add_argument("--steps", type=int, default=20)
+    benchmark.add_argument("--batch-size", type=int, default=8)
+    benchmark.add_argument("--seq-len", type=int, default=128)
+    args = parser.parse_args()
+
+    if args.mode == "apeach":
+        train_apeach(args.r, args.output_dir, args.num_epochs, args.batch_size, args.learning_rate, args.cache_dir,
+                     args.cpu_mode)
+        if world_info()[1] > 1:
+            dist.destroy_process_group()
+    else:
+        run_scaling_benchmark(args.model, args.world_sizes, args.steps, args.batch_size, args.seq_len)
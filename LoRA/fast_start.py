@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 빠른 콜드 스타트용 추론 진입점
+#
+# 기존 스크립트는 첫 `get_outputs()` 호출 전에 transformers, peft, datasets, torch를 모두 import하고
+# `bigscience/bloomz-560m`을 메모리에 통째로 복사해 올린 뒤 `PeftModel.from_pretrained`로 감쌉니다.
+# 오토스케일링되는 추론 워커는 뜰 때마다 이 비용을 냅니다.
+#
+# 이 진입점은
+# - 모듈 최상단에서는 서빙에 필요한 것(torch, 표준 라이브러리)만 import하고 peft / datasets는 전혀 쓰지 않으며
+# - safetensors 헤더를 직접 읽고 파일을 읽기 전용 mmap으로 열어 torch.frombuffer로 텐서를 만들고
+#   meta 디바이스에서 만든 모델에 assign=True로 연결합니다. (복사 없음, 페이지 캐시를 통해 워커 프로세스끼리 공유)
+# - 토크나이저는 `tokenizers` 라이브러리의 tokenizer.json만 읽습니다.
+# - LoRA 어댑터는 multi_adapter.AdapterRegistry로 등록만 해두고, 처음 요청될 때 읽습니다.
+#
+# mmap 공유는 파일의 dtype 그대로 쓸 때만 유지됩니다. (merge_export.py로 내보낸 fp32 체크포인트 권장)
+#
+# 실행 예시 (slim / 기존 경로를 워커 4개씩 띄워 첫 토큰까지 시간과 프로세스별 private 메모리 비교):
+#
+#     python fast_start.py --model-dir ./fused_model --benchmark --workers 4
+
+import argparse
+import json
+import mmap
+import os
+import subprocess
+import sys
+import time
+import warnings
+
+import torch
+
+safetensors_dtypes = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+# safetensors 파일 하나를 mmap으로 열어 {이름: 텐서}를 돌려줍니다. 텐서는 mmap 버퍼를 그대로 가리킵니다.
+def mmap_safetensors(path):
+    with open(path, "rb") as f:
+        header_size = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = safetensors_dtypes[info["dtype"]]
+        start, end = info["data_offsets"]
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        # 읽기 전용 버퍼이므로 torch가 경고를 내지만, 추론에서는 가중치를 쓰지 않습니다.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + start)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+def mmap_checkpoint(model_dir):
+    index_path = os.path.join(model_dir, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            files = sorted(set(json.load(f)["weight_map"].values()))
+    else:
+        files = ["model.safetensors"]
+    state_dict = {}
+    for filename in files:
+        state_dict.update(mmap_safetensors(os.path.join(model_dir, filename)))
+    return state_dict
+
+
+def resolve_model_dir(model):
+    if os.path.isdir(model):
+        return model
+    from huggingface_hub import snapshot_download
+
+    return snapshot_download(model, allow_patterns=["*.json", "*.safetensors"])
+
+
+# meta 디바이스에서 모델 구조만 만들고 mmap 텐서를 그대로 연결합니다.
+def load_model_mmap(model_dir, dtype=None):
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    config = AutoConfig.from_pretrained(model_dir)
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(config)
+    state_dict = mmap_checkpoint(model_dir)
+    if dtype is not None:
+        state_dict = {name: tensor.to(dtype) for name, tensor in state_dict.items()}
+    # Bloom 허브 체크포인트처럼 "transformer." 접두사 없이 저장된 경우를 맞춰줍니다.
+    expected = set(model.state_dict())
+    prefix = model.base_model_prefix + "."
+    state_dict = {
+        prefix + name if name not in expected and prefix + name in expected else name: tensor
+        for name, tensor in state_dict.items()
+    }
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+    missing = [name for name, tensor in model.state_dict().items() if tensor.is_meta]
+    if missing:
+        raise ValueError(f"체크포인트에 없는 가중치가 있습니다: {missing[:5]}")
+    return model.eval().requires_grad_(False)
+
+
+class SlimTokenizer:
+    # ContinuousBatchingEngine에 필요한 만큼만 구현한 tokenizers 기반 토크나이저
+    def __init__(self, model_dir):
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        special_tokens = {}
+        for filename in ["special_tokens_map.json", "tokenizer_config.json"]:
+            path = os.path.join(model_dir, filename)
+            if os.path.exists(path):
+                with open(path) as f:
+                    for key, value in json.load(f).items():
+                        if key in ("eos_token", "pad_token") and key not in special_tokens and value:
+                            special_tokens[key] = value["content"] if isinstance(value, dict) else value
+        self.eos_token_id = self.tokenizer.token_to_id(special_tokens.get("eos_token", "</s>"))
+        pad_token = special_tokens.get("pad_token")
+        self.pad_token_id = self.tokenizer.token_to_id(pad_token) if pad_token else None
+
+    def __call__(self, text):
+        return {"input_ids": self.tokenizer.encode(text).ids}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return self.tokenizer.decode(ids, skip_special_tokens=skip_special_tokens)
+
+
+# 기본 모델 + (선택) LoRA 어댑터 경로들로 서빙 엔진을 만듭니다. 어댑터는 첫 요청 때 읽습니다.
+def build_engine(model_dir, adapters=None, max_batch_size=8, dtype=None):
+    from serving import ContinuousBatchingEngine
+
+    model = load_model_mmap(model_dir, dtype)
+    tokenizer = SlimTokenizer(model_dir)
+    registry = None
+    if adapters:
+        from multi_adapter import AdapterRegistry
+
+        registry = AdapterRegistry(model)
+        for name, path in adapters.items():
+            registry.register(name, path)
+    return ContinuousBatchingEngine(model, tokenizer, max_batch_size, adapter_registry=registry)
+
+
+# /proc/self/smaps_rollup에서 이 프로세스만 쓰는(공유되지 않은) 메모리를 읽습니다.
+def private_memory_bytes():
+    total = 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean", "Private_Dirty")):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+# 워커 실행 시각(launched_at, time.time())부터 첫 토큰까지의 시간을 잽니다. torch import 시간도 포함됩니다.
+def time_to_first_token(mode, model_dir, adapter, prompt, launched_at, dtype=None):
+    if mode == "slim":
+        engine = build_engine(model_dir, {"adapter": adapter} if adapter else None, dtype=dtype)
+        engine.submit(prompt, max_new_tokens=1, adapter="adapter" if adapter else None)
+        engine.run_until_idle()
+    else:
+        # 기존 스크립트와 같은 경로
+        import datasets  # noqa: F401
+        import peft
+        import transformers
+
+        tokenizer = transformers.AutoTokenizer.from_pretrained(model_dir)
+        model = transformers.AutoModelForCausalLM.from_pretrained(model_dir, dtype=dtype)
+        if adapter:
+            model = peft.PeftModel.from_pretrained(model, adapter, is_trainable=False)
+        from serving import get_outputs
+
+        get_outputs(model, tokenizer, tokenizer(prompt, return_tensors="pt"), max_new_tokens=1)
+    return {"mode": mode, "ttft": time.time() - launched_at, "private_mb": private_memory_bytes() / 1024 ** 2}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="bigscience/bloomz-560m")
+    parser.add_argument("--adapter", default=None)
+    parser.add_argument("--prompt", default="I want you to act as a motivational coach. ")
+    parser.add_argument("--dtype", choices=["float32", "bfloat16"], default=None)
+    parser.add_argument("--mode", choices=["slim", "baseline"], default=None)
+    parser.add_argument("--launched-at", type=float, default=None)
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    model_dir = resolve_model_dir(args.model_dir)
+    dtype = getattr(torch, args.dtype) if args.dtype else None
+
+    if args.benchmark:
+        for mode in ["baseline", "slim"]:
+            command = [sys.executable, __file__, "--model-dir", model_dir, "--mode", mode, "--prompt", args.prompt]
+            if args.adapter:
+                command += ["--adapter", args.adapter]
+            if args.dtype:
+                command += ["--dtype", args.dtype]
+            # 워커를 동시에 띄워, 공유 페이지 캐시 효과까지 포함해 잽니다.
+            processes = [
+                subprocess.Popen(command + ["--launched-at", str(time.time())], stdout=subprocess.PIPE, text=True)
+                for _ in range(args.workers)
+            ]
+            results = [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in processes]
+            ttft = sorted(result["ttft"] for result in results)
+            private = sorted(result["private_mb"] for result in results)
+            print(f"[{mode}] 워커 {args.workers}개 - 첫 토큰까지: 중앙값 {ttft[len(ttft) // 2]:.2f}s, "
+                  f"최대 {ttft[-1]:.2f}s / 프로세스별 private 메모리: 중앙값 {private[len(private) // 2]:.0f}MB")
+    elif args.mode is not None:
+        print(json.dumps(time_to_first_token(args.mode, model_dir, args.adapter, args.prompt, args.launched_at, dtype)))
+    else:
+        engine = build_engine(model_dir, {"adapter": args.adapter} if args.adapter else None, dtype=dtype)
+        request = engine.submit(args.prompt, max_new_tokens=100, adapter="adapter" if args.adapter else None)
+        engine.run_until_idle()
+        print(engine.tokenizer.decode(request.token_ids))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # LoRA 어댑터 병합/복원 및 단일 추론 체크포인트 내보내기
+#
+# Bloom 스크립트는 추론할 때도 `PeftModel` 래퍼를 그대로 쓰기 때문에, 매 forward마다 `query_key_value`에서
+# 저랭크 행렬곱과 드롭아웃 훅 비용을 추가로 냅니다.
+#
+# - merge_lora(): 저장된 `lora_model`의 델타(scaling * B @ A, bias="lora_only" bias)를 기본 가중치에 더합니다.
+#   원래 가중치를 보관해 두므로 unmerge_lora()로 비트 단위까지 정확하게 되돌릴 수 있습니다.
+# - export_fused_checkpoint(): 병합된 모델을 PEFT 없이 `AutoModelForCausalLM.from_pretrained`로 읽을 수 있는
+#   체크포인트로 저장합니다. quantize_int8=True이면 transformer 블록의 Linear 가중치를 채널별 int8로
+#   저장합니다. 이 int8 체크포인트는 transformers 표준 형식이 아니라서 `AutoModelForCausalLM.from_pretrained`로는
+#   읽을 수 없고(가중치 파일이 없다는 OSError), load_fused_model()로만 읽습니다. (마찬가지로 PEFT를 import하지 않습니다.)
+#   출력 디렉터리에는 이를 알리는 README.md를 함께 씁니다.
+#
+# 실행 예시 (병합 전 어댑터 / 병합 / int8 병합의 지연 시간과 출력 비교):
+#
+#     python merge_export.py --model bigscience/bloomz-560m --adapter ./peft_lab_outputs/lora_model
+
+import argparse
+import json
+import os
+import time
+
+import torch
+
+quantization_file = "int8_quantization.json"
+
+int8_readme = """# int8 weight-only 체크포인트
+
+이 디렉터리는 transformers 표준 체크포인트가 아닙니다. `AutoModelForCausalLM.from_pretrained(<이 디렉터리>)`로는
+읽을 수 없습니다. (`model_int8.safetensors`만 있고 `model.safetensors`가 없어 OSError가 납니다.)
+
+다음처럼 읽습니다.
+
+    from merge_export import load_fused_model
+    model = load_fused_model("<이 디렉터리>")
+
+int8로 저장된 Linear 모듈 목록은 `int8_quantization.json`에 있습니다.
+"""
+
+
+# 어댑터 델타를 기본 모델 가중치에 병합하고, 복원에 필요한 원래 가중치를 돌려줍니다.
+def merge_lora(model, adapter_path):
+    from multi_adapter import load_lora_adapter
+
+    weight = next(model.parameters())
+    adapter = load_lora_adapter("merge", adapter_path, model, weight.device, torch.float32)
+    originals = {}
+    with torch.no_grad():
+        for module_name, layer in adapter.layers.items():
+            module = model.get_submodule(module_name)
+            originals[module_name] = {name: param.detach().clone() for name, param in module.named_parameters()}
+            if "A" in layer:
+                delta = adapter.scaling * (layer["B"] @ layer["A"])
+                module.weight.copy_((module.weight.float() + delta).to(module.weight.dtype))
+            if "bias" in layer:
+                module.bias.copy_((module.bias.float() + layer["bias"]).to(module.bias.dtype))
+    return originals
+
+
+# merge_lora()가 돌려준 원래 가중치로 되돌립니다.
+def unmerge_lora(model, originals):
+    with torch.no_grad():
+        for module_name, params in originals.items():
+            module = model.get_submodule(module_name)
+            for name, value in params.items():
+                getattr(module, name).copy_(value)
+
+
+# 출력 채널(행)별 대칭 int8 양자화
+def quantize_per_channel(weight):
+    scale = weight.abs().amax(dim=1).clamp(min=1e-8) / 127
+    quantized = torch.round(weight / scale[:, None]).clamp(-127, 127).to(torch.int8)
+    return quantized, scale.float()
+
+
+class Int8WeightOnlyLinear(torch.nn.Module):
+    # 가중치만 int8로 보관하고 활성값은 원래 dtype으로 계산합니다.
+    def __init__(self, in_features, out_features, bias=True):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.register_buffer("weight", torch.zeros(out_features, in_features, dtype=torch.int8))
+        self.register_buffer("weight_scale", torch.ones(out_features))
+        self.bias = torch.nn.Parameter(torch.zeros(out_features)) if bias else None
+
+    @classmethod
+    def from_linear(cls, linear):
+        module = cls(linear.in_features, linear.out_features, linear.bias is not None)
+        module.weight, module.weight_scale = quantize_per_channel(linear.weight.detach().float())
+        if linear.bias is not None:
+            module.bias = torch.nn.Parameter(linear.bias.detach().float(), requires_grad=False)
+        return module
+
+    def forward(self, x):
+        x2d = x.reshape(-1, self.in_features)
+        if x2d.dtype == torch.float32 and x2d.device.type == "cpu" and hasattr(torch, "_weight_int8pack_mm"):
+            # CPU int8 weight-only 행렬곱 커널 (가중치를 fp32로 풀어놓지 않음)
+            out = torch._weight_int8pack_mm(x2d.contiguous(), self.weight, self.weight_scale)
+        else:
+            out = x2d @ (self.weight.to(x2d.dtype) * self.weight_scale.to(x2d.dtype)[:, None]).t()
+        if self.bias is not None:
+            out = out + self.bias.to(out.dtype)
+        return out.view(*x.shape[:-1], self.out_features)
+
+
+# transformer 블록 안의 Linear만 양자화합니다. (lm_head는 word_embeddings와 가중치를 공유하므로 제외)
+def int8_target_names(model):
+    return [name for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Linear) and not name.endswith("lm_head")]
+
+
+def replace_linears_with_int8(model, names, quantize=True):
+    for name in names:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        linear = getattr(parent, child_name)
+        if quantize:
+            module = Int8WeightOnlyLinear.from_linear(linear)
+        else:
+            module = Int8WeightOnlyLinear(linear.in_features, linear.out_features, linear.bias is not None)
+        setattr(parent, child_name, module)
+    return model
+
+
+def export_fused_checkpoint(model_name, adapter_path, output_dir, quantize_int8=False):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model = AutoModelForCausalLM.from_pretrained(model_name)
+    merge_lora(model, adapter_path)
+    os.makedirs(output_dir, exist_ok=True)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+
+    if not quantize_int8:
+        model.save_pretrained(output_dir)
+        return output_dir
+
+    from safetensors.torch import save_file
+
+    names = int8_target_names(model)
+    replace_linears_with_int8(model, names)
+    model.config.save_pretrained(output_dir)
+    if model.generation_config is not None:
+        model.generation_config.save_pretrained(output_dir)
+    # 공유(tied) 가중치는 한 번만 저장합니다.
+    state_dict = {name: tensor.contiguous() for name, tensor in model.state_dict().items()
+                  if not name.endswith("lm_head.weight")}
+    save_file(state_dict, os.path.join(output_dir, "model_int8.safetensors"))
+    with open(os.path.join(output_dir, quantization_file), "w") as f:
+        json.dump({"weights": "model_int8.safetensors", "int8_linear_modules": names}, f, indent=2)
+    with open(os.path.join(output_dir, "README.md"), "w") as f:
+        f.write(int8_readme)
+    return output_dir
+
+
+# 내보낸 체크포인트를 PEFT 없이 불러옵니다.
+def load_fused_model(path):
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    quantization_path = os.path.join(path, quantization_file)
+    if not os.path.exists(quantization_path):
+        return AutoModelForCausalLM.from_pretrained(path).eval()
+
+    from safetensors.torch import load_file
+
+    with open(quantization_path) as f:
+        quantization = json.load(f)
+    model = AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(path))
+    replace_linears_with_int8(model, quantization["int8_linear_modules"], quantize=False)
+    model.load_state_dict(load_file(os.path.join(path, quantization["weights"])), strict=False, assign=True)
+    model.tie_weights()
+    return model.eval()
+
+
+# 프롬프트별 생성 시간(토큰당 지연)과 기준 모델 대비 토큰 일치율을 잽니다.
+def measure(model, tokenizer, prompts, max_new_tokens, reference=None):
+    from serving import get_outputs
+
+    outputs, elapsed, new_tokens = [], 0.0, 0
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = get_outputs(model, tokenizer, inputs, max_new_tokens=max_new_tokens)[0]
+        elapsed += time.perf_counter() - start
+        generated = output[inputs["input_ids"].shape[1]:].tolist()
+        new_tokens += len(generated)
+        outputs.append(generated)
+
+    agreement = None
+    if reference is not None:
+        matched = total = 0
+        for generated, expected in zip(outputs, reference):
+            total += max(len(generated), len(expected))
+            matched += sum(a == b for a, b in zip(generated, expected))
+        agreement = matched / max(1, total)
+    return outputs, elapsed / max(1, new_tokens), agreement
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="bigscience/bloomz-560m")
+    parser.add_argument("--adapter", default="./peft_lab_outputs/lora_model")
+    parser.add_argument("--output-dir", default=None)
+    parser.add_argument("--max-new-tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    prompts = [
+        "I want you to act as a motivational coach. ",
+        "I want you to act as a travel guide. ",
+        "I want you to act as a storyteller. ",
+    ]
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+
+    # 기준: 병합하지 않은 PeftModel
+    from peft import PeftModel
+
+    start = time.perf_counter()
+    peft_model = PeftModel.from_pretrained(AutoModelForCausalLM.from_pretrained(args.model), args.adapter).eval()
+    load_time = time.perf_counter() - start
+    reference, latency, _ = measure(peft_model, tokenizer, prompts, args.max_new_tokens)
+    print(f"[PeftModel] 로드: {load_time:.2f}s, 토큰당 지연: {latency * 1000:.1f}ms")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = args.output_dir or tmp_dir
+        for label, quantize_int8 in [("merged", False), ("merged-int8", True)]:
+            path = export_fused_checkpoint(args.model, args.adapter, os.path.join(output_dir, label), quantize_int8)
+            start = time.perf_counter()
+            model = load_fused_model(path)
+            load_time = time.perf_counter() - start
+            _, latency, agreement = measure(model, tokenizer, prompts, args.max_new_tokens, reference)
+            print(f"[{label}] 로드: {load_time:.2f}s, 토큰당 지연: {latency * 1000:.1f}ms, "
+                  f"PeftModel 대비 토큰 일치율: {agreement:.1%}")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 스트리밍 지표 누적기
+#
+# APEACH 노트북은 에포크마다 train/eval 각각 `load_metric("accuracy")`, `load_metric("f1")`,
+# `load_metric("precision")`, `load_metric("recall")`을 다시 불러오고, 배치마다 add_batch를 네 번 호출하며,
+# `loss.item()`으로 매 배치 디바이스 동기화를 일으킵니다.
+#
+# ConfusionMatrixAccumulator는 혼동 행렬(confusion matrix)과 손실 합계를 디바이스 위 텐서로 유지하고
+# 배치마다 index_add_ 한 번으로 갱신합니다. 호스트로 값을 옮기는 것은 에포크 끝의 compute() 한 번뿐입니다.
+#
+# Bloom 스크립트(Trainer)에서는 다음처럼 사용할 수 있습니다. (어휘 크기가 커서 혼동 행렬 대신 토큰 정확도를 누적)
+#
+#     training_args = TrainingArguments(..., batch_eval_metrics=True)
+#     trainer = Trainer(..., compute_metrics=StreamingTrainerMetrics(causal_lm=True),
+#                       preprocess_logits_for_metrics=preprocess_logits_for_metrics)
+
+import torch
+
+
+class ConfusionMatrixAccumulator:
+    def __init__(self, num_classes=2, device=None, positive_label=1):
+        self.num_classes = num_classes
+        self.positive_label = positive_label
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.matrix = torch.zeros(self.num_classes, self.num_classes, dtype=torch.long, device=self.device)
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=self.device)
+        self.count = torch.zeros((), dtype=torch.long, device=self.device)
+
+    # predictions: [batch] 예측 라벨 또는 [batch, num_classes] 로짓, references: [batch] 정답 라벨
+    # loss가 주어지면 배치 평균 손실로 보고 샘플 수만큼 가중해 더합니다.
+    @torch.no_grad()
+    def update(self, predictions, references, loss=None):
+        if predictions.dim() > references.dim():
+            predictions = predictions.argmax(dim=-1)
+        references = references.to(self.matrix.device)
+        # bincount는 CUDA에서 길이를 정하려고 .max().item()으로 동기화하므로 index_add_로 셉니다.
+        index = (references * self.num_classes + predictions.to(self.matrix.device)).flatten().long()
+        self.matrix.view(-1).index_add_(0, index, torch.ones_like(index))
+        if loss is not None:
+            self.loss_sum += loss.detach().to(self.loss_sum) * references.numel()
+        self.count += references.numel()
+
+    # 데이터 병렬 학습에서 모든 rank의 혼동 행렬과 손실 합계를 더합니다. (분산 초기화 전에는 아무것도 하지 않음)
+    def all_reduce(self):
+        import torch.distributed as dist
+
+        if dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1:
+            for tensor in (self.matrix, self.loss_sum, self.count):
+                dist.all_reduce(tensor)
+
+    # 행: 정답, 열: 예측
+    def compute(self):
+        matrix = self.matrix.double().cpu()
+        count = int(self.count.cpu())
+        true_positive = matrix.diag()
+        predicted = matrix.sum(dim=0)
+        actual = matrix.sum(dim=1)
+
+        precision = torch.where(predicted > 0, true_positive / predicted.clamp(min=1), torch.zeros_like(predicted))
+        recall = torch.where(actual > 0, true_positive / actual.clamp(min=1), torch.zeros_like(actual))
+        denominator = precision + recall
+        f1 = torch.where(denominator > 0, 2 * precision * recall / denominator.clamp(min=1e-12),
+                         torch.zeros_like(denominator))
+
+        accuracy = float(true_positive.sum() / max(1, count))
+        label = self.positive_label
+        return {
+            "accuracy": accuracy,
+            # evaluate 라이브러리 기본값(average="binary", pos_label=1)과 같은 값
+            "f1": float(f1[label]),
+            "precision": float(precision[label]),
+            "recall": float(recall[label]),
+            "f1_macro": float(f1.mean()),
+            "precision_macro": float(precision.mean()),
+            "recall_macro": float(recall.mean()),
+            # 단일 라벨 분류에서 micro 평균은 정확도와 같습니다.
+            "f1_micro": accuracy,
+            "precision_micro": accuracy,
+            "recall_micro": accuracy,
+            "loss": float(self.loss_sum.cpu()) / max(1, count),
+        }
+
+
+class TokenAccuracyAccumulator:
+    # 인과적 언어 모델용: 다음 토큰 예측 정확도를 누적합니다. (-100 라벨은 무시)
+    def __init__(self, device=None, ignore_index=-100):
+        self.device = device
+        self.ignore_index = ignore_index
+        self.reset()
+
+    def reset(self):
+        self.correct = torch.zeros((), dtype=torch.long, device=self.device)
+        self.count = torch.zeros((), dtype=torch.long, device=self.device)
+
+    @torch.no_grad()
+    def update(self, predictions, labels):
+        # 위치 t의 예측은 위치 t+1의 라벨과 비교합니다.
+        predictions = predictions[:, :-1].to(self.correct.device)
+        labels = labels[:, 1:].to(self.correct.device)
+        mask = labels != self.ignore_index
+        self.correct += (predictions.eq(labels) & mask).sum()
+        self.count += mask.sum()
+
+    def compute(self):
+        return {"token_accuracy": int(self.correct.cpu()) / max(1, int(self.count.cpu()))}
+
+
+# Trainer가 전체 로짓 대신 argmax 결과만 넘기도록 합니다.
+def preprocess_logits_for_metrics(logits, labels):
+    if isinstance(logits, tuple):
+        logits = logits[0]
+    return logits.argmax(dim=-1)
+
+
+class StreamingTrainerMetrics:
+    # TrainingArguments(batch_eval_metrics=True)와 함께 compute_metrics로 넘깁니다.
+    # Trainer가 배치마다 호출하고, 마지막 배치에서 compute_result=True로 최종 값을 요청합니다.
+    def __init__(self, causal_lm=False, num_classes=2):
+        self.causal_lm = causal_lm
+        self.num_classes = num_classes
+        self.accumulator = None
+
+    def __call__(self, eval_pred, compute_result=False):
+        predictions = torch.as_tensor(eval_pred.predictions)
+        labels = torch.as_tensor(eval_pred.label_ids)
+        # 첫 배치가 올라와 있는 디바이스에서 누적합니다.
+        if self.accumulator is None:
+            if self.causal_lm:
+                self.accumulator = TokenAccuracyAccumulator(device=predictions.device)
+            else:
+                self.accumulator = ConfusionMatrixAccumulator(self.num_classes, device=predictions.device)
+        self.accumulator.update(predictions, labels)
+        if not compute_result:
+            return {}
+        result = self.accumulator.compute()
+        self.accumulator = None
+        result.pop("loss", None)
+        return result
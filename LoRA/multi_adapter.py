@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 멀티 어댑터 서빙: 하나의 고정된 Bloom 기반 모델 + 여러 LoRA 어댑터
+#
+# 노트북은 `PeftModel.from_pretrained(foundation_model, peft_model_path)`로 어댑터 하나를 감싸고
+# 모델 전체를 `.to(device)` 합니다. 어댑터를 추가할 때마다 bloomz-560m 한 벌이 통째로 필요합니다.
+#
+# 여기서는 `foundation_model`을 한 번만 올려두고 `query_key_value` 레이어만 `MultiLoraLinear`로 감쌉니다.
+# 저장된 `lora_model` 디렉터리에서 lora_A / lora_B (및 bias="lora_only"로 학습된 bias)만 읽어오며,
+# 배치 안의 행마다 다른 어댑터의 저랭크 델타를 더합니다. 기본 가중치에는 병합하지 않습니다.
+# 어댑터는 메모리 예산을 넘으면 LRU 순서로 내려갑니다.
+#
+# 실행 예시 (무작위 어댑터 50개로 메모리/처리량 측정):
+#
+#     python multi_adapter.py --model bigscience/bloomz-560m --num-adapters 50
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import torch
+
+
+# 현재 프로세스의 RSS(resident set size)를 바이트 단위로 읽습니다. (Linux)
+def current_rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+# 저장된 어댑터 state dict를 읽습니다. (safetensors 우선, 없으면 .bin)
+def load_adapter_state_dict(path):
+    safetensors_path = os.path.join(path, "adapter_model.safetensors")
+    if os.path.exists(safetensors_path):
+        from safetensors.torch import load_file
+        return load_file(safetensors_path)
+    return torch.load(os.path.join(path, "adapter_model.bin"), map_location="cpu", weights_only=True)
+
+
+@dataclass
+class LoraAdapter:
+    name: str
+    scaling: float
+    # 모듈 이름 -> {"A": [r, in], "B": [out, r], "bias": [out] (기본 bias와의 차이, 없을 수 있음)}
+    layers: dict = field(default_factory=dict)
+
+    @property
+    def nbytes(self):
+        return sum(t.numel() * t.element_size() for layer in self.layers.values() for t in layer.values())
+
+
+# `lora_model` 디렉터리 하나를 LoraAdapter로 읽어옵니다.
+# 기본 모델의 bias와 비교해야 하므로 base_model을 함께 받습니다.
+def load_lora_adapter(name, path, base_model, device=None, dtype=None):
+    with open(os.path.join(path, "adapter_config.json")) as f:
+        config = json.load(f)
+    if config.get("fan_in_fan_out"):
+        raise ValueError(f"{name}: fan_in_fan_out=True 어댑터는 지원하지 않습니다.")
+    r = config["r"]
+    scaling = config["lora_alpha"] / (r ** 0.5 if config.get("use_rslora") else r)
+
+    base_modules = dict(base_model.named_modules())
+    adapter = LoraAdapter(name, scaling)
+    for key, tensor in load_adapter_state_dict(path).items():
+        key = key.removeprefix("base_model.model.")
+        if key.endswith(".lora_A.weight"):
+            module_name, part = key[:-len(".lora_A.weight")], "A"
+        elif key.endswith(".lora_B.weight"):
+            module_name, part = key[:-len(".lora_B.weight")], "B"
+        elif key.endswith(".base_layer.bias") or key.endswith(".bias"):
+            # bias="lora_only"로 학습된 bias: 기본 bias와의 차이만 보관합니다.
+            module_name = key.removesuffix(".bias").removesuffix(".base_layer")
+            part = "bias"
+            base = base_modules[module_name]
+            base = getattr(base, "base_layer", base)
+            tensor = tensor.to(base.bias.dtype) - base.bias.detach().cpu()
+        else:
+            continue
+        adapter.layers.setdefault(module_name, {})[part] = tensor.to(device=device, dtype=dtype)
+    return adapter
+
+
+class MultiLoraLinear(torch.nn.Module):
+    def __init__(self, base_layer, module_name, registry):
+        super().__init__()
+        self.base_layer = base_layer
+        self.module_name = module_name
+        # registry는 nn.Module이 아니므로 서브모듈로 등록되지 않도록 object.__setattr__을 사용합니다.
+        object.__setattr__(self, "registry", registry)
+
+    def forward(self, x):
+        out = self.base_layer(x)
+        routing = self.registry.routing
+        if routing is None:
+            return out
+
+        # 같은 어댑터를 쓰는 행끼리 묶어 한 번에 계산합니다.
+        for adapter, rows in routing:
+            layer = adapter.layers.get(self.module_name)
+            if layer is None:
+                continue
+            h = x.index_select(0, rows)
+            delta = (h @ layer["A"].t()) @ layer["B"].t() * adapter.scaling
+            if "bias" in layer:
+                delta = delta + layer["bias"]
+            out = out.index_add(0, rows, delta.to(out.dtype))
+        return out
+
+
+class AdapterRegistry:
+    def __init__(self, base_model, target_modules=("query_key_value",), memory_budget_bytes=512 * 1024 ** 2):
+        self.base_model = base_model.eval()
+        for param in self.base_model.parameters():
+            param.requires_grad = False
+        self.memory_budget_bytes = memory_budget_bytes
+        self.paths = {}
+        self.resident = OrderedDict()
+        self.routing = None
+        self.loads = 0
+        self.evictions = 0
+
+        weight = next(base_model.parameters())
+        self.device, self.dtype = weight.device, weight.dtype
+
+        # 대상 Linear 레이어를 MultiLoraLinear로 교체합니다.
+        targets = [
+            name for name, module in base_model.named_modules()
+            if isinstance(module, torch.nn.Linear) and name.split(".")[-1] in target_modules
+        ]
+        for name in targets:
+            parent_name, _, child_name = name.rpartition(".")
+            parent = base_model.get_submodule(parent_name)
+            setattr(parent, child_name, MultiLoraLinear(getattr(parent, child_name), name, self))
+
+    # 어댑터 경로만 등록합니다. 실제 로드는 처음 사용할 때 이루어집니다.
+    def register(self, name, path):
+        self.paths[name] = path
+
+    @property
+    def resident_bytes(self):
+        return sum(adapter.nbytes for adapter in self.resident.values())
+
+    def get(self, name, pinned=()):
+        if name in self.resident:
+            self.resident.move_to_end(name)
+            return self.resident[name]
+
+        adapter = load_lora_adapter(name, self.paths[name], self.base_model, self.device, self.dtype)
+        self.loads += 1
+        self.resident[name] = adapter
+        self._evict(pinned)
+        return adapter
+
+    # 메모리 예산을 넘으면 가장 오래 사용하지 않은 어댑터부터 내립니다.
+    # 현재 배치에서 사용 중인 어댑터(pinned)는 내리지 않습니다.
+    def _evict(self, pinned):
+        for name in list(self.resident):
+            if self.resident_bytes <= self.memory_budget_bytes:
+                break
+            if name in pinned:
+                continue
+            del self.resident[name]
+            self.evictions += 1
+
+    # 배치의 각 행이 사용할 어댑터 이름 목록을 받아 forward 동안 라우팅을 설정합니다.
+    # None인 행은 기본 모델만 사용합니다.
+    @contextmanager
+    def route(self, adapter_names):
+        pinned = {name for name in adapter_names if name is not None}
+        groups = OrderedDict()
+        for row, name in enumerate(adapter_names):
+            if name is not None:
+                groups.setdefault(name, []).append(row)
+        self.routing = [
+            (self.get(name, pinned), torch.tensor(rows, dtype=torch.long, device=self.device))
+            for name, rows in groups.items()
+        ]
+        try:
+            yield
+        finally:
+            self.routing = None
+
+
+# 벤치마크용 무작위 어댑터를 저장합니다. (노트북과 같은 lora_config)
+# PeftModel 하나를 만들고 lora_B만 다시 초기화해 가며 어댑터마다 저장합니다.
+def make_random_adapters(model_name, num_adapters, output_dir):
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForCausalLM
+
+    lora_config = LoraConfig(
+        r=4,
+        lora_alpha=1,
+        target_modules=["query_key_value"],
+        lora_dropout=0.05,
+        bias="lora_only",
+        task_type="CAUSAL_LM"
+    )
+    peft_model = get_peft_model(AutoModelForCausalLM.from_pretrained(model_name), lora_config)
+    paths = {}
+    for i in range(num_adapters):
+        for name, param in peft_model.named_parameters():
+            if "lora_B" in name:
+                torch.nn.init.normal_(param, std=0.02)
+        paths[f"adapter_{i}"] = os.path.join(output_dir, f"adapter_{i}")
+        peft_model.save_pretrained(paths[f"adapter_{i}"])
+    return paths
+
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from serving import ContinuousBatchingEngine
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="bigscience/bloomz-560m")
+    parser.add_argument("--num-adapters", type=int, default=50)
+    parser.add_argument("--num-requests", type=int, default=64)
+    parser.add_argument("--max-new-tokens", type=int, default=50)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--memory-budget-mb", type=float, default=512)
+    # 주어지면 이 디렉터리에 무작위 어댑터만 저장하고 끝냅니다. (아래 벤치마크가 자식 프로세스로 호출)
+    parser.add_argument("--make-adapters", default=None)
+    args = parser.parse_args()
+
+    if args.make_adapters is not None:
+        print(json.dumps(make_random_adapters(args.model, args.num_adapters, args.make_adapters)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as adapter_dir:
+        # 어댑터 생성에 쓴 모델이 RSS 측정에 섞이지 않도록 별도 프로세스에서 만듭니다.
+        output = subprocess.run(
+            [sys.executable, __file__, "--model", args.model, "--num-adapters", str(args.num_adapters),
+             "--make-adapters", adapter_dir],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        paths = json.loads(output.strip().splitlines()[-1])
+
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        foundation_model = AutoModelForCausalLM.from_pretrained(args.model)
+        rss_base = current_rss_bytes()
+
+        registry = AdapterRegistry(foundation_model, memory_budget_bytes=int(args.memory_budget_mb * 1024 ** 2))
+        for name, path in paths.items():
+            registry.register(name, path)
+        for name in paths:
+            registry.get(name)
+        rss_adapters = current_rss_bytes()
+        print(f"기본 모델 RSS: {rss_base / 1024 ** 2:.0f}MB, 어댑터 {len(registry.resident)}개 상주 후: "
+              f"{rss_adapters / 1024 ** 2:.0f}MB (어댑터 합계 {registry.resident_bytes / 1024 ** 2:.1f}MB)")
+
+        engine = ContinuousBatchingEngine(foundation_model, tokenizer, args.max_batch_size, adapter_registry=registry)
+        for label, names in [("단일 어댑터", ["adapter_0"] * args.num_requests),
+                             ("혼합 어댑터", [random.choice(list(paths)) for _ in range(args.num_requests)])]:
+            start = time.perf_counter()
+            requests = [
+                engine.submit("I want you to act as a motivational coach. ", args.max_new_tokens, adapter=name)
+                for name in names
+            ]
+            engine.run_until_idle()
+            elapsed = time.perf_counter() - start
+            new_tokens = sum(len(request.output_ids) for request in requests)
+            print(f"[{label}] tokens/sec: {new_tokens / elapsed:.1f}")
+        print(f"어댑터 로드: {registry.loads}회, 축출: {registry.evictions}회")
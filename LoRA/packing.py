@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # causal LM LoRA 학습용 시퀀스 패킹
+#
+# Bloom 스크립트는 `train_sample`을 `DataCollatorForLanguageModeling(tokenizer, mlm=False)`로 배치마다 가장 긴
+# 프롬프트 길이에 맞춰 패딩합니다. 프롬프트 길이가 제각각이라 연산의 상당 부분이 패딩 토큰에 쓰입니다.
+#
+# 여기서는 토크나이즈된 프롬프트를 block_size 길이의 블록에 순서대로 이어 붙입니다. (블록에 들어가지 않으면 다음 블록으로)
+# - attention mask는 문서 경계를 지키는 블록 대각 causal mask(4D)라 서로 다른 예제끼리 attend하지 않습니다.
+# - position_ids는 문서마다 0부터 다시 시작합니다.
+# - 각 문서의 첫 토큰은 labels를 -100으로 두어 앞 문서의 마지막 토큰에서 예측하지 않습니다.
+# 따라서 토큰별 loss는 오른쪽 패딩(padding_side="right") 배치와 같고(부동소수점 오차 제외), 패딩 토큰만 줄어듭니다.
+# 왼쪽 패딩 배치는 짧은 행의 첫 토큰도 패드 위치에서 예측하도록 학습하므로 loss가 조금 다릅니다.
+#
+# Bloom은 ALiBi 위치 편향을 2D attention mask로 만들기 때문에 enable_packed_attention()으로 4D mask를 받을 수
+# 있게 해야 합니다. ALiBi 편향은 key 위치에 비례하고 softmax는 행마다 상수를 더해도 변하지 않으므로, 블록 대각 mask 아래에서
+# 블록 전체 위치로 만든 편향은 문서별 위치로 만든 편향과 결과가 같습니다.
+#
+# Bloom 스크립트에서는 다음처럼 사용할 수 있습니다. (IterableDataset이므로 max_steps가 필요하고,
+# Trainer가 document_lengths를 지우지 않도록 remove_unused_columns=False로 둡니다.)
+#
+#     enable_packed_attention(peft_model)
+#     trainer = Trainer(model=peft_model, args=TrainingArguments(..., max_steps=100, remove_unused_columns=False),
+#                       train_dataset=PackedBlocks(train_sample, block_size=256),
+#                       data_collator=PackedCollator(tokenizer.pad_token_id))
+#
+# 실행 예시 (패딩 collator와 패킹의 유효 토큰/초, 에포크별 loss 비교):
+#
+#     python packing.py --model bigscience/bloomz-560m --num-samples 50 --block-size 256
+
+import argparse
+import time
+
+import torch
+
+
+class PackedBlocks(torch.utils.data.IterableDataset):
+    # datasets의 Dataset / IterableDataset을 chunk_size씩 읽어가며 블록을 만듭니다. 전체 코퍼스를 메모리에 올리지 않습니다.
+    # 이미 input_ids 컬럼이 있으면(Bloom 스크립트의 data.map 결과) 그대로 쓰고, 없으면 text_column을 토크나이즈합니다.
+    # block_size보다 긴 문서는 block_size 단위로 잘라 각각 별도 문서로 다룹니다.
+    def __init__(self, dataset, tokenizer=None, block_size=256, text_column="prompt", chunk_size=1000,
+                 add_eos=False):
+        self.dataset = dataset
+        self.tokenizer = tokenizer
+        self.block_size = block_size
+        self.text_column = text_column
+        self.chunk_size = chunk_size
+        self.add_eos = add_eos
+
+    def documents(self):
+        for chunk in self.dataset.iter(batch_size=self.chunk_size):
+            if "input_ids" in chunk:
+                ids_list = chunk["input_ids"]
+            else:
+                ids_list = self.tokenizer(chunk[self.text_column])["input_ids"]
+            for ids in ids_list:
+                ids = list(ids)
+                if self.add_eos:
+                    ids.append(self.tokenizer.eos_token_id)
+                for start in range(0, len(ids), self.block_size):
+                    yield ids[start:start + self.block_size]
+
+    def __iter__(self):
+        input_ids, lengths = [], []
+        for ids in self.documents():
+            if not ids:
+                continue
+            if len(input_ids) + len(ids) > self.block_size:
+                yield {"input_ids": input_ids, "document_lengths": lengths}
+                input_ids, lengths = [], []
+            input_ids = input_ids + ids
+            lengths.append(len(ids))
+        if input_ids:
+            yield {"input_ids": input_ids, "document_lengths": lengths}
+
+
+class PackedCollator:
+    # PackedBlocks의 블록들을 모델 입력으로 만듭니다. (배치 안 가장 긴 블록 길이에 맞춰 오른쪽 패딩)
+    def __init__(self, pad_token_id, mask_dtype=torch.float32, return_position_ids=True):
+        self.pad_token_id = pad_token_id
+        self.mask_dtype = mask_dtype
+        self.return_position_ids = return_position_ids
+
+    def __call__(self, blocks):
+        batch_size = len(blocks)
+        length = max(len(block["input_ids"]) for block in blocks)
+        input_ids = torch.full((batch_size, length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, length), -100, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, length), dtype=torch.long)
+        # 패딩 위치는 -1, 나머지는 블록 안 문서 번호
+        document_ids = torch.full((batch_size, length), -1, dtype=torch.long)
+
+        for row, block in enumerate(blocks):
+            ids = torch.tensor(block["input_ids"], dtype=torch.long)
+            input_ids[row, :len(ids)] = ids
+            labels[row, :len(ids)] = ids
+            start = 0
+            for document, document_length in enumerate(block["document_lengths"]):
+                end = start + document_length
+                position_ids[row, start:end] = torch.arange(document_length)
+                document_ids[row, start:end] = document
+                labels[row, start] = -100
+                start = end
+
+        # 같은 문서 안에서 앞쪽(자기 자신 포함)만 볼 수 있습니다. 패딩 위치는 자기 자신만 봅니다.
+        causal = torch.ones(length, length, dtype=torch.bool).tril()
+        allowed = (document_ids[:, :, None] == document_ids[:, None, :]) & causal
+        allowed |= torch.eye(length, dtype=torch.bool)
+        attention_mask = torch.zeros((batch_size, 1, length, length), dtype=self.mask_dtype)
+        attention_mask.masked_fill_(~allowed[:, None], torch.finfo(self.mask_dtype).min)
+
+        batch = {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+        if self.return_position_ids:
+            batch["position_ids"] = position_ids
+        return batch
+
+
+def _packed_alibi_tensor(self, attention_mask, num_heads, dtype):
+    if attention_mask.dim() == 4:
+        batch_size, _, _, length = attention_mask.shape
+        attention_mask = torch.ones((batch_size, length), device=attention_mask.device)
+    return type(self).build_alibi_tensor(self, attention_mask, num_heads, dtype)
+
+
+# Bloom(ALiBi) 모델이 PackedCollator의 4D attention mask를 받을 수 있게 합니다. 다른 모델은 그대로 둡니다.
+def enable_packed_attention(model):
+    patched = 0
+    for module in model.modules():
+        if hasattr(module, "build_alibi_tensor") and "build_alibi_tensor" not in vars(module):
+            module.build_alibi_tensor = _packed_alibi_tensor.__get__(module)
+            patched += 1
+    return patched
+
+
+# 패딩 collator 배치와 패킹 배치 모두 labels != -100인 위치(첫 토큰 제외)가 실제로 학습되는 토큰입니다.
+def trained_tokens(batch):
+    return int((batch["labels"][:, 1:] != -100).sum())
+
+
+# 데이터 전체에 대한 토큰 가중 평균 loss (두 파이프라인의 loss가 같은지 확인용)
+@torch.no_grad()
+def corpus_loss(model, batches):
+    total_loss, total_tokens = 0.0, 0
+    model.eval()
+    for batch in batches:
+        tokens = trained_tokens(batch)
+        total_loss += float(model(**batch).loss) * tokens
+        total_tokens += tokens
+    return total_loss / max(1, total_tokens)
+
+
+# 같은 데이터로 num_epochs만큼 학습하며 에포크별 토큰 가중 평균 loss와 유효 토큰/초를 잽니다.
+def train_pipeline(model, batches, num_epochs, learning_rate, pad_token_id):
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=learning_rate)
+    real = sum(int((batch["input_ids"] != pad_token_id).sum()) for batch in batches)
+    history = {"epoch_loss": [], "tokens_per_sec": [],
+               "padding_ratio": 1 - real / sum(batch["input_ids"].numel() for batch in batches)}
+    model.train()
+    for _ in range(num_epochs):
+        total_loss, total_tokens = 0.0, 0
+        start = time.perf_counter()
+        for batch in batches:
+            loss = model(**batch).loss
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            tokens = trained_tokens(batch)
+            total_loss += loss.item() * tokens
+            total_tokens += tokens
+        history["tokens_per_sec"].append(total_tokens / (time.perf_counter() - start))
+        history["epoch_loss"].append(total_loss / max(1, total_tokens))
+    return history
+
+
+if __name__ == "__main__":
+    from datasets import load_dataset
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForCausalLM, AutoTokenizer, DataCollatorForLanguageModeling
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="bigscience/bloomz-560m")
+    parser.add_argument("--dataset", default="fka/awesome-chatgpt-prompts")
+    parser.add_argument("--text-column", default="prompt")
+    parser.add_argument("--num-samples", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--block-size", type=int, default=256)
+    parser.add_argument("--num-epochs", type=int, default=3)
+    parser.add_argument("--learning-rate", type=float, default=3e-4)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    data = load_dataset(args.dataset, split="train").select(range(args.num_samples))
+    tokenized = data.map(lambda samples: tokenizer(samples[args.text_column]), batched=True,
+                         remove_columns=data.column_names)
+
+    # 같은 토큰에 loss를 주도록 비교용 패딩 배치는 오른쪽 패딩으로 만듭니다.
+    tokenizer.padding_side = "right"
+    padded_collator = DataCollatorForLanguageModeling(tokenizer, mlm=False)
+    pipelines = {
+        "padded": [padded_collator(tokenized.select(range(start, min(start + args.batch_size, len(tokenized))))
+                                   .to_list())
+                   for start in range(0, len(tokenized), args.batch_size)],
+    }
+    blocks = list(PackedBlocks(tokenized, block_size=args.block_size))
+    packed_collator = PackedCollator(tokenizer.pad_token_id)
+    # 패킹 배치는 같은 토큰 수가 되도록 블록 단위로 나눕니다.
+    tokens_per_batch = sum(len(ids) for ids in tokenized["input_ids"]) / len(pipelines["padded"])
+    packed_batch_size = max(1, round(tokens_per_batch / args.block_size))
+    pipelines["packed"] = [packed_collator(blocks[start:start + packed_batch_size])
+                           for start in range(0, len(blocks), packed_batch_size)]
+
+    torch.manual_seed(0)
+    base_model = AutoModelForCausalLM.from_pretrained(args.model)
+    initial_state = {name: tensor.clone() for name, tensor in base_model.state_dict().items()}
+    for name, batches in pipelines.items():
+        base_model.load_state_dict(initial_state)
+        torch.manual_seed(0)
+        model = get_peft_model(base_model, LoraConfig(r=4, lora_alpha=1, target_modules=["query_key_value"],
+                                                      lora_dropout=0.0, bias="lora_only", task_type="CAUSAL_LM"))
+        enable_packed_attention(model)
+        initial_loss = corpus_loss(model, batches)
+        history = train_pipeline(model, batches, args.num_epochs, args.learning_rate, tokenizer.pad_token_id)
+        losses = ", ".join(f"{loss:.4f}" for loss in history["epoch_loss"])
+        print(f"[{name}] 배치 {len(batches)}개, 패딩 비율 {history['padding_ratio']:.1%}, 초기 loss {initial_loss:.4f}, "
+              f"에포크별 loss [{losses}], 유효 토큰/초 {sum(history['tokens_per_sec']) / args.num_epochs:.0f}")
+        base_model = model.unload()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 학습 / 생성 핫패스 계측
+#
+# 지금까지 성능 신호는 tqdm 진행 막대와 `print_trainable_parameters()`뿐이라, lora_config나 target_modules, r 값을
+# 바꿨을 때 처리량이 얼마나 변하는지 알 수 없습니다.
+#
+# - StepProfiler: 스텝마다 tokenize(배치 가져오기 + 토크나이즈/collate), forward, backward, optimizer, metric 시간을
+#   나눠 기록하고, 토큰/초, samples/초, 최대 RSS를 집계합니다. 처음 warmup 스텝은 집계에서 뺍니다.
+# - ModuleTimer: forward 훅으로 모듈별 forward 시간을 재고, LoRA로 감싼 레이어 / 고정(frozen) 레이어 /
+#   학습되는 레이어(classifier 등)로 나눠 합칩니다. (gradient checkpointing을 쓰면 backward 중 재계산도 포함됩니다.)
+#
+# APEACH 루프는 `apeach_lora.train_and_evaluate(..., profiler=StepProfiler(model))`로,
+# Bloom 스크립트(Trainer)는 `Trainer(..., callbacks=[trainer_callback(profiler)])`로 켭니다.
+# Trainer에서는 metric 시간이 없고, backward 시간은 (optimizer 직전까지 시간 - forward 시간)으로 계산합니다.
+# 생성은 profile_generation()으로 잽니다.
+#
+# 오프라인 벤치마크와 기준선 대비 회귀 검사는 benchmark_suite.py를 참고하세요.
+
+import contextlib
+import statistics
+import time
+
+import cpu_training
+
+step_phases = ("tokenize", "forward", "backward", "optimizer", "metric")
+
+
+class ModuleTimer:
+    # LoRA 레이어(lora_A를 가진 PEFT 레이어)는 기본 레이어를 포함한 전체를 한 번에 재고, 그 안의 모듈은 따로 재지 않습니다.
+    # 나머지는 자식이 없는 모듈(leaf)만 잽니다.
+    def __init__(self, model):
+        self.times = {}
+        self.calls = {}
+        self.kinds = {}
+        self._starts = {}
+        self._handles = []
+        lora_prefixes = []
+        for name, module in model.named_modules():
+            if any(name.startswith(prefix) for prefix in lora_prefixes):
+                continue
+            if hasattr(module, "lora_A"):
+                lora_prefixes.append(name + ".")
+                kind = "lora"
+            elif next(module.children(), None) is None:
+                kind = "trainable" if any(p.requires_grad for p in module.parameters(recurse=False)) else "frozen"
+            else:
+                continue
+            self.kinds[name] = kind
+            self._handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+            self._handles.append(module.register_forward_hook(self._post_hook(name)))
+
+    def _pre_hook(self, name):
+        def hook(module, args):
+            self._starts[name] = time.perf_counter()
+        return hook
+
+    def _post_hook(self, name):
+        def hook(module, args, output):
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - self._starts.pop(name)
+            self.calls[name] = self.calls.get(name, 0) + 1
+        return hook
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    # 종류별 합계(ms)와 가장 오래 걸린 모듈 top_k
+    def summary(self, top_k=5):
+        by_kind = {}
+        for name, seconds in self.times.items():
+            kind = by_kind.setdefault(self.kinds[name], {"modules": 0, "forward_ms": 0.0})
+            kind["modules"] += 1
+            kind["forward_ms"] += seconds * 1000
+        slowest = sorted(self.times.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return {
+            "by_kind": by_kind,
+            "slowest": [{"name": name, "kind": self.kinds[name], "forward_ms": seconds * 1000,
+                         "calls": self.calls[name]} for name, seconds in slowest],
+        }
+
+
+class StepProfiler:
+    def __init__(self, model=None, module_timing=True, warmup=1):
+        self.warmup = warmup
+        self.steps = []
+        self.current = {}
+        self.tokens = 0
+        self.samples = 0
+        self.module_timer = ModuleTimer(model) if model is not None and module_timing else None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    # 한 스텝의 단계별 시간을 확정합니다. warmup 스텝은 버리고 모듈 시간도 초기화합니다.
+    def end_step(self, tokens=0, samples=0):
+        step, self.current = self.current, {}
+        if self.warmup > 0:
+            self.warmup -= 1
+            if self.module_timer is not None:
+                self.module_timer.reset()
+            return
+        self.steps.append(step)
+        self.tokens += tokens
+        self.samples += samples
+
+    def summary(self):
+        step_seconds = [sum(step.values()) for step in self.steps]
+        total = sum(step_seconds)
+        names = list(step_phases) + sorted({name for step in self.steps for name in step} - set(step_phases))
+        result = {
+            "steps": len(self.steps),
+            "step_ms_median": statistics.median(step_seconds) * 1000 if step_seconds else 0.0,
+            "phase_ms": {name: 1000 * sum(step.get(name, 0.0) for step in self.steps) / max(1, len(self.steps))
+                         for name in names},
+            "tokens_per_sec": self.tokens / total if total else 0.0,
+            "samples_per_sec": self.samples / total if total else 0.0,
+            # 프로세스 전체의 최대 RSS(ru_maxrss)라 줄어들지 않습니다. 케이스별로 비교하려면 케이스마다 별도 프로세스에서
+            # 재야 합니다. (benchmark_suite.py 참고)
+            "peak_rss_mb": cpu_training.peak_rss_bytes() / 1024 ** 2,
+        }
+        if self.module_timer is not None:
+            result["modules"] = self.module_timer.summary()
+        return result
+
+    def close(self):
+        if self.module_timer is not None:
+            self.module_timer.remove()
+
+    def __str__(self):
+        summary = self.summary()
+        phases = ", ".join(f"{name} {ms:.1f}ms" for name, ms in summary["phase_ms"].items() if ms)
+        text = (f"스텝 {summary['steps']}개, 스텝 중앙값 {summary['step_ms_median']:.1f}ms ({phases}), "
+                f"토큰/초 {summary['tokens_per_sec']:.0f}, 최대 RSS {summary['peak_rss_mb']:.0f}MB")
+        if "modules" in summary:
+            kinds = ", ".join(f"{kind} {value['forward_ms']:.0f}ms/{value['modules']}개"
+                              for kind, value in summary["modules"]["by_kind"].items())
+            text += f"\n  모듈별 forward 합계: {kinds}"
+        return text
+
+
+# Trainer 콜백: 스텝 사이 시간을 tokenize(데이터 로딩 + collate), 모델 forward 훅으로 forward,
+# optimizer 직전까지의 나머지를 backward, optimizer.step()을 optimizer로 기록합니다.
+def trainer_callback(profiler):
+    from transformers import TrainerCallback
+
+    class ProfilerCallback(TrainerCallback):
+        def __init__(self):
+            self.marks = {}
+            self.forward_seconds = 0.0
+            self.tokens = 0
+            self.handles = []
+
+        def _forward_pre_hook(self, module, args, kwargs):
+            input_ids = kwargs.get("input_ids", args[0] if args else None)
+            if input_ids is not None and module.training:
+                self.tokens += input_ids.numel()
+            self.marks["forward"] = time.perf_counter()
+
+        def _forward_hook(self, module, args, kwargs, output):
+            self.forward_seconds += time.perf_counter() - self.marks.pop("forward")
+
+        def on_train_begin(self, args, state, control, model=None, **kwargs):
+            self.handles = [model.register_forward_pre_hook(self._forward_pre_hook, with_kwargs=True),
+                            model.register_forward_hook(self._forward_hook, with_kwargs=True)]
+            self.marks["step_end"] = time.perf_counter()
+
+        def on_step_begin(self, args, state, control, **kwargs):
+            now = time.perf_counter()
+            profiler.add("tokenize", now - self.marks["step_end"])
+            self.marks["step_begin"] = now
+            self.forward_seconds = 0.0
+            self.tokens = 0
+
+        def on_pre_optimizer_step(self, args, state, control, **kwargs):
+            now = time.perf_counter()
+            profiler.add("forward", self.forward_seconds)
+            profiler.add("backward", now - self.marks["step_begin"] - self.forward_seconds)
+            self.marks["optimizer"] = now
+
+        def on_step_end(self, args, state, control, **kwargs):
+            now = time.perf_counter()
+            profiler.add("optimizer", now - self.marks["optimizer"])
+            batch_size = args.per_device_train_batch_size * args.gradient_accumulation_steps
+            profiler.end_step(tokens=self.tokens, samples=batch_size)
+            self.marks["step_end"] = time.perf_counter()
+
+        def on_train_end(self, args, state, control, **kwargs):
+            for handle in self.handles:
+                handle.remove()
+
+    return ProfilerCallback()
+
+
+# 프롬프트마다 tokenize / forward(get_outputs 생성) / decode 시간을 기록합니다. 토큰/초는 새로 생성한 토큰 기준입니다.
+def profile_generation(model, tokenizer, prompts, max_new_tokens=100, profiler=None):
+    import torch
+
+    from serving import get_outputs
+
+    profiler = profiler or StepProfiler(model, warmup=0)
+    device = next(model.parameters()).device
+    for prompt in prompts:
+        with profiler.phase("tokenize"):
+            inputs = tokenizer(prompt, return_tensors="pt").to(device)
+        with profiler.phase("forward"), torch.no_grad():
+            outputs = get_outputs(model, tokenizer, inputs, max_new_tokens=max_new_tokens)
+        new_tokens = outputs.shape[1] - inputs["input_ids"].shape[1]
+        with profiler.phase("decode"):
+            tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        profiler.end_step(tokens=new_tokens, samples=1)
+    return profiler
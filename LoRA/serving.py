@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 연속 배칭(continuous batching) 추론 서버
+#
+# `LoRA_Tuning_PEFT_ipynb.py`의 `get_outputs()`는 프롬프트 하나에 대해 `model.generate`를 한 번 호출하고
+# 끝날 때까지 블로킹합니다. CPU 서버에서는 요청을 하나씩만 처리하게 됩니다.
+#
+# 이 모듈은 같은 생성 규칙(greedy, `repetition_penalty=1.5`, `eos_token_id` 종료)을 유지하면서
+# - 요청 큐에 들어온 프롬프트를 왼쪽 패딩(left padding)으로 묶어 한 번에 prefill 하고
+# - 디코딩 스텝마다 새 시퀀스를 배치에 합류시키고, 끝난 시퀀스는 배치에서 제거하며
+# - 실행 중인 시퀀스 전체의 KV 캐시를 왼쪽 패딩된 배치 캐시 하나로 유지합니다. 새 요청이 합류할 때만 패딩해 이어붙이고,
+#   끝난 시퀀스는 배치 방향 index_select로 빼므로 디코딩 스텝마다 캐시를 다시 합치거나 나누지 않습니다.
+#
+# 실행 예시:
+#
+#     python serving.py --model bigscience/bloomz-560m --num-requests 32 --max-batch-size 8
+
+import argparse
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+import torch
+
+
+# 노트북의 get_outputs()와 동일한 단일 프롬프트 경로 (벤치마크 기준선)
+def get_outputs(model, tokenizer, inputs, max_new_tokens=100):
+    outputs = model.generate(
+        input_ids=inputs["input_ids"],
+        attention_mask=inputs["attention_mask"],
+        max_new_tokens=max_new_tokens,       # 생성할 최대 토큰 수
+        repetition_penalty=1.5,              # 반복되는 문장 생성을 방지
+        early_stopping=True,                 # 최대 길이에 도달하지 않아도 종료 가능
+        eos_token_id=tokenizer.eos_token_id  # 종료 토큰 ID 지정
+    )
+    return outputs
+
+
+# 캐시 객체 <-> 레이어별 (key, value) 튜플 리스트 변환
+# key/value의 모양은 [batch, heads, seq, head_dim] 입니다.
+def cache_to_tuples(past_key_values):
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return list(past_key_values.to_legacy_cache())
+    return list(past_key_values)
+
+
+def tuples_to_cache(layers):
+    from transformers import DynamicCache
+
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(tuple(layers))
+
+
+# 왼쪽 패딩된 배치 캐시 여러 개를 가장 긴 길이에 맞춰 왼쪽을 더 패딩하고 배치 방향으로 이어붙입니다.
+# caches: 레이어별 (key, value) 튜플 리스트들, masks: 각 캐시의 과거 위치 attention mask [batch, past_len]
+# 반환값: (배치 캐시, 과거 위치에 대한 attention mask)
+def merge_caches(caches, masks):
+    max_len = max(mask.shape[1] for mask in masks)
+    merged = []
+    for layer_idx in range(len(caches[0])):
+        keys, values = [], []
+        for cache in caches:
+            key, value = cache[layer_idx]
+            pad = max_len - key.shape[2]
+            if pad:
+                key = torch.nn.functional.pad(key, (0, 0, pad, 0))
+                value = torch.nn.functional.pad(value, (0, 0, pad, 0))
+            keys.append(key)
+            values.append(value)
+        merged.append((torch.cat(keys, dim=0), torch.cat(values, dim=0)))
+
+    past_mask = torch.cat([torch.nn.functional.pad(mask, (max_len - mask.shape[1], 0)) for mask in masks], dim=0)
+    return merged, past_mask
+
+
+# 배치 캐시에서 rows 행만 남깁니다. 남은 행 모두에게 패딩인 앞쪽 위치는 잘라냅니다.
+def select_rows(layers, past_mask, rows):
+    index = torch.tensor(rows, dtype=torch.long, device=past_mask.device)
+    past_mask = past_mask.index_select(0, index)
+    start = int(past_mask.any(dim=0).long().argmax())
+    layers = [(key.index_select(0, index)[:, :, start:], value.index_select(0, index)[:, :, start:])
+              for key, value in layers]
+    return layers, past_mask[:, start:]
+
+
+# transformers의 RepetitionPenaltyLogitsProcessor와 같은 규칙:
+# 이미 등장한 토큰의 점수가 음수면 penalty를 곱하고, 양수면 penalty로 나눕니다.
+def apply_repetition_penalty(logits, token_ids, penalty):
+    if penalty == 1.0:
+        return logits
+    for row, ids in enumerate(token_ids):
+        index = torch.tensor(sorted(set(ids)), dtype=torch.long, device=logits.device)
+        score = logits[row].index_select(0, index)
+        score = torch.where(score < 0, score * penalty, score / penalty)
+        logits[row].index_copy_(0, index, score)
+    return logits
+
+
+@dataclass
+class GenerationRequest:
+    prompt_ids: list
+    max_new_tokens: int = 100
+    adapter: str = None
+    output_ids: list = field(default_factory=list)
+    submitted_at: float = 0.0
+    first_token_at: float = None
+    finished_at: float = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def token_ids(self):
+        return self.prompt_ids + self.output_ids
+
+    @property
+    def latency(self):
+        return self.finished_at - self.submitted_at
+
+    def result(self, timeout=None):
+        self.done.wait(timeout)
+        return self.token_ids
+
+
+class ContinuousBatchingEngine:
+    def __init__(self, model, tokenizer, max_batch_size=8, repetition_penalty=1.5, adapter_registry=None):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.repetition_penalty = repetition_penalty
+        # multi_adapter.AdapterRegistry를 넘기면 요청마다 다른 LoRA 어댑터로 라우팅합니다.
+        self.adapter_registry = adapter_registry
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self.eos_token_id = tokenizer.eos_token_id
+        self.device = next(model.parameters()).device
+        self.waiting = queue.Queue()
+        # running의 순서가 곧 배치 캐시의 행 순서입니다.
+        self.running = []
+        self.cache = None
+        self.past_mask = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # 프롬프트(문자열)를 큐에 넣고 GenerationRequest를 돌려줍니다.
+    def submit(self, prompt, max_new_tokens=100, adapter=None):
+        prompt_ids = self.tokenizer(prompt)["input_ids"]
+        request = GenerationRequest(prompt_ids, max_new_tokens, adapter, submitted_at=time.perf_counter())
+        self.waiting.put(request)
+        return request
+
+    def _forward(self, requests, **kwargs):
+        if self.adapter_registry is None:
+            return self.model(**kwargs)
+        with self.adapter_registry.route([request.adapter for request in requests]):
+            return self.model(**kwargs)
+
+    # 새 요청들을 왼쪽 패딩으로 묶어 prefill 하고, 그 캐시를 실행 중인 배치 캐시 뒤에 이어붙입니다.
+    def _prefill(self, requests):
+        max_len = max(len(request.prompt_ids) for request in requests)
+        input_ids = torch.full((len(requests), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), max_len), dtype=torch.long)
+        for row, request in enumerate(requests):
+            length = len(request.prompt_ids)
+            input_ids[row, max_len - length:] = torch.tensor(request.prompt_ids)
+            attention_mask[row, max_len - length:] = 1
+        attention_mask = attention_mask.to(self.device)
+
+        outputs = self._forward(
+            requests,
+            input_ids=input_ids.to(self.device),
+            attention_mask=attention_mask,
+            use_cache=True,
+        )
+        if self.cache is None:
+            self.cache, self.past_mask = outputs.past_key_values, attention_mask
+        else:
+            layers, self.past_mask = merge_caches(
+                [cache_to_tuples(self.cache), cache_to_tuples(outputs.past_key_values)],
+                [self.past_mask, attention_mask],
+            )
+            self.cache = tuples_to_cache(layers)
+        self._emit(requests, outputs.logits[:, -1, :])
+
+    # 실행 중인 모든 시퀀스에 대해 토큰 하나를 디코딩합니다. 배치 캐시는 모델 안에서 제자리로 늘어납니다.
+    def _decode(self, requests):
+        attention_mask = torch.cat(
+            [self.past_mask, torch.ones(len(requests), 1, dtype=torch.long, device=self.device)], dim=1)
+        input_ids = torch.tensor([[request.output_ids[-1]] for request in requests], dtype=torch.long)
+
+        outputs = self._forward(
+            requests,
+            input_ids=input_ids.to(self.device),
+            attention_mask=attention_mask,
+            past_key_values=self.cache,
+            use_cache=True,
+        )
+        self.cache, self.past_mask = outputs.past_key_values, attention_mask
+        self._emit(requests, outputs.logits[:, -1, :])
+
+    def _emit(self, requests, logits):
+        logits = apply_repetition_penalty(logits.float(), [r.token_ids for r in requests], self.repetition_penalty)
+        next_tokens = torch.argmax(logits, dim=-1).tolist()
+        now = time.perf_counter()
+        for request, token in zip(requests, next_tokens):
+            request.output_ids.append(token)
+            if request.first_token_at is None:
+                request.first_token_at = now
+            if token == self.eos_token_id or len(request.output_ids) >= request.max_new_tokens:
+                request.finished_at = now
+                request.done.set()
+
+    # 끝난 시퀀스의 행을 배치 캐시에서 뺍니다.
+    def _drop_finished(self):
+        rows = [row for row, request in enumerate(self.running) if not request.done.is_set()]
+        if len(rows) == len(self.running):
+            return
+        self.running = [self.running[row] for row in rows]
+        if not rows:
+            self.cache = self.past_mask = None
+            return
+        layers, self.past_mask = select_rows(cache_to_tuples(self.cache), self.past_mask, rows)
+        self.cache = tuples_to_cache(layers)
+
+    # 한 스케줄링 스텝: 빈 자리만큼 대기 요청을 합류시키고, 실행 중인 배치를 한 토큰 진행합니다.
+    @torch.no_grad()
+    def step(self):
+        decoding = list(self.running)
+        admitted = []
+        while len(decoding) + len(admitted) < self.max_batch_size:
+            try:
+                admitted.append(self.waiting.get_nowait())
+            except queue.Empty:
+                break
+
+        if decoding:
+            self._decode(decoding)
+            self._drop_finished()
+        if admitted:
+            self._prefill(admitted)
+            self.running += admitted
+            self._drop_finished()
+        return bool(decoding or admitted)
+
+    def run_until_idle(self):
+        while self.step():
+            pass
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if not self.step():
+                time.sleep(0.001)
+
+
+# 지연 시간 리스트에서 백분위 값을 구합니다.
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name, latencies, new_tokens, elapsed):
+    print(f"[{name}] 요청 수: {len(latencies)}, 생성 토큰: {new_tokens}, 소요 시간: {elapsed:.2f}s")
+    print(f"[{name}] tokens/sec: {new_tokens / elapsed:.1f}, "
+          f"p50: {percentile(latencies, 50) * 1000:.0f}ms, p99: {percentile(latencies, 99) * 1000:.0f}ms")
+
+
+# 로컬 대체 클라이언트: 같은 프롬프트 집합을 단일 프롬프트 경로와 엔진에 보내 비교합니다.
+def benchmark(model, tokenizer, prompts, max_new_tokens, max_batch_size):
+    # 기존 경로: 요청이 한꺼번에 도착해도 하나씩 순서대로 처리됩니다.
+    start = time.perf_counter()
+    latencies, new_tokens = [], 0
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        outputs = get_outputs(model, tokenizer, inputs, max_new_tokens=max_new_tokens)
+        latencies.append(time.perf_counter() - start)
+        new_tokens += outputs.shape[1] - inputs["input_ids"].shape[1]
+    summarize("get_outputs", latencies, new_tokens, time.perf_counter() - start)
+
+    # 연속 배칭 엔진
+    engine = ContinuousBatchingEngine(model, tokenizer, max_batch_size=max_batch_size)
+    engine.start()
+    start = time.perf_counter()
+    requests = [engine.submit(prompt, max_new_tokens=max_new_tokens) for prompt in prompts]
+    for request in requests:
+        request.result()
+    elapsed = time.perf_counter() - start
+    engine.stop()
+    summarize("continuous_batching", [r.latency for r in requests], sum(len(r.output_ids) for r in requests), elapsed)
+
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="bigscience/bloomz-560m")
+    parser.add_argument("--num-requests", type=int, default=32)
+    parser.add_argument("--max-new-tokens", type=int, default=100)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+
+    base_prompts = [
+        "I want you to act as a motivational coach. ",
+        "I want you to act as a travel guide. ",
+        "I want you to act as a storyteller. ",
+        "I want you to act as a Linux terminal. ",
+    ]
+    prompts = [base_prompts[i % len(base_prompts)] for i in range(args.num_requests)]
+    benchmark(model, tokenizer, prompts, args.max_new_tokens, args.max_batch_size)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 작은 드래프트 모델을 이용한 speculative decoding
+#
+# `get_outputs()`는 `repetition_penalty=1.5`로 최대 300 토큰까지 한 토큰씩 생성하므로 CPU 지연 시간이
+# 출력 길이에 비례해 늘어납니다.
+#
+# 여기서는 작은 드래프트 모델(예: `bigscience/bloomz-560m`)이 k개 토큰을 먼저 제안하고,
+# 대상 모델(예: LoRA로 튜닝한 `bigscience/bloom-1b1`)이 한 번의 forward로 k개 위치를 모두 검증합니다.
+# 각 위치에서 대상 모델의 로짓에 그 위치까지의 토큰 이력으로 repetition penalty를 적용한 뒤 argmax를 구하고,
+# 드래프트 토큰과 같은 동안만 받아들입니다. 처음 다른 위치에서는 대상 모델의 토큰을 씁니다.
+# 따라서 생성 규칙(greedy + repetition_penalty + eos 종료 + max_new_tokens)은 get_outputs()와 같습니다.
+# (여러 토큰을 한 번에 계산할 때의 부동소수점 오차로 argmax가 거의 동점인 경우에만 달라질 수 있습니다.)
+#
+# 두 모델은 같은 토크나이저(어휘)를 써야 합니다. Bloom 계열은 모두 같은 토크나이저를 씁니다.
+#
+# 실행 예시:
+#
+#     python speculative.py --target bigscience/bloom-1b1 --target-adapter ./lora_model \
+#         --draft bigscience/bloomz-560m --k 4
+
+import argparse
+import time
+from dataclasses import dataclass
+
+import torch
+
+from serving import apply_repetition_penalty, get_outputs
+
+
+@dataclass
+class SpeculativeStats:
+    proposed: int = 0
+    accepted: int = 0
+    target_forwards: int = 0
+    new_tokens: int = 0
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted / max(1, self.proposed)
+
+    def __iadd__(self, other):
+        self.proposed += other.proposed
+        self.accepted += other.accepted
+        self.target_forwards += other.target_forwards
+        self.new_tokens += other.new_tokens
+        return self
+
+
+def _crop(cache, length):
+    if length >= _cache_length(cache):
+        return cache
+    if hasattr(cache, "crop"):
+        # 음수는 뒤에서부터 잘라낼 토큰 수입니다.
+        cache.crop(length - cache.get_seq_length())
+        return cache
+    return tuple((key[:, :, :length], value[:, :, :length]) for key, value in cache)
+
+
+def _cache_length(cache):
+    if cache is None:
+        return 0
+    if hasattr(cache, "get_seq_length"):
+        return cache.get_seq_length()
+    return cache[0][0].shape[2]
+
+
+class SpeculativeDecoder:
+    def __init__(self, target_model, draft_model, tokenizer, k=4, repetition_penalty=1.5):
+        self.target_model = target_model.eval()
+        self.draft_model = draft_model.eval()
+        self.tokenizer = tokenizer
+        self.k = k
+        self.repetition_penalty = repetition_penalty
+        self.eos_token_id = tokenizer.eos_token_id
+        self.device = next(target_model.parameters()).device
+
+    # 캐시에 아직 없는 토큰(tokens[cache_len:])을 넣어 forward하고, 위치별 로짓과 갱신된 캐시를 돌려줍니다.
+    def _forward(self, model, tokens, cache):
+        input_ids = torch.tensor([tokens[_cache_length(cache):]], dtype=torch.long, device=self.device)
+        outputs = model(input_ids=input_ids, past_key_values=cache, use_cache=True)
+        return outputs.logits[0].float(), outputs.past_key_values
+
+    def _next_token(self, logits, history):
+        logits = apply_repetition_penalty(logits.unsqueeze(0).clone(), [history], self.repetition_penalty)
+        return int(torch.argmax(logits, dim=-1))
+
+    # 입력(토크나이저 출력, 배치 크기 1)에 대해 get_outputs()와 같은 모양의 출력과 통계를 돌려줍니다.
+    @torch.no_grad()
+    def generate(self, inputs, max_new_tokens=100):
+        tokens = inputs["input_ids"][0].tolist()
+        prompt_len = len(tokens)
+        target_cache = draft_cache = None
+        stats = SpeculativeStats()
+
+        while len(tokens) - prompt_len < max_new_tokens:
+            remaining = max_new_tokens - (len(tokens) - prompt_len)
+            k = min(self.k, remaining - 1)
+
+            # 1) 드래프트 모델이 k개 토큰을 greedy(+ 같은 penalty)로 제안합니다.
+            drafts = []
+            for _ in range(k):
+                logits, draft_cache = self._forward(self.draft_model, tokens + drafts, draft_cache)
+                drafts.append(self._next_token(logits[-1], tokens + drafts))
+                if drafts[-1] == self.eos_token_id:
+                    break
+
+            # 2) 대상 모델이 기존 토큰 + 드래프트 전체를 한 번에 계산합니다.
+            logits, target_cache = self._forward(self.target_model, tokens + drafts, target_cache)
+            stats.target_forwards += 1
+            logits = logits[-(len(drafts) + 1):]
+
+            # 3) 앞에서부터 대상 모델의 선택과 같은 드래프트만 받아들입니다.
+            accepted = 0
+            next_token = self._next_token(logits[0], tokens)
+            while accepted < len(drafts) and next_token == drafts[accepted]:
+                accepted += 1
+                next_token = self._next_token(logits[accepted], tokens + drafts[:accepted])
+            stats.proposed += len(drafts)
+            stats.accepted += accepted
+
+            new_tokens = drafts[:accepted] + [next_token]
+            if self.eos_token_id in new_tokens:
+                new_tokens = new_tokens[:new_tokens.index(self.eos_token_id) + 1]
+            tokens.extend(new_tokens)
+            if tokens[-1] == self.eos_token_id:
+                break
+
+            # 받아들인 부분까지만 캐시를 남깁니다. (마지막 토큰은 다음 forward에서 넣습니다.)
+            target_cache = _crop(target_cache, len(tokens) - 1)
+            draft_cache = _crop(draft_cache, min(_cache_length(draft_cache), len(tokens) - 1))
+
+        stats.new_tokens = len(tokens) - prompt_len
+        return torch.tensor([tokens], dtype=torch.long), stats
+
+
+# 프롬프트 집합에 대해 get_outputs()와 speculative decoding의 시간, 수락률, 출력 일치를 비교합니다.
+def benchmark(decoder, prompts, max_new_tokens):
+    tokenizer = decoder.tokenizer
+    total = SpeculativeStats()
+    baseline_time = speculative_time = 0.0
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors="pt").to(decoder.device)
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            expected = get_outputs(decoder.target_model, tokenizer, inputs, max_new_tokens=max_new_tokens)
+        baseline_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        output, stats = decoder.generate(inputs, max_new_tokens=max_new_tokens)
+        elapsed = time.perf_counter() - start
+        speculative_time += elapsed
+        total += stats
+
+        same = output[0].tolist() == expected[0].tolist()
+        print(f"- 수락률 {stats.acceptance_rate:.1%}, 토큰 {stats.new_tokens}, 대상 forward {stats.target_forwards}회, "
+              f"출력 일치: {same}, {prompt!r}")
+    print(f"전체 수락률: {total.acceptance_rate:.1%}, 대상 forward당 토큰: "
+          f"{total.new_tokens / max(1, total.target_forwards):.2f}, "
+          f"속도 향상: {baseline_time / max(speculative_time, 1e-9):.2f}x "
+          f"({baseline_time:.1f}s -> {speculative_time:.1f}s)")
+    return total
+
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", default="bigscience/bloom-1b1")
+    parser.add_argument("--target-adapter", default=None)
+    parser.add_argument("--draft", default="bigscience/bloomz-560m")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=100)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.target)
+    target_model = AutoModelForCausalLM.from_pretrained(args.target)
+    if args.target_adapter:
+        from merge_export import merge_lora
+
+        # 검증 forward의 LoRA 오버헤드를 없애기 위해 어댑터를 병합해 둡니다.
+        merge_lora(target_model, args.target_adapter)
+    draft_model = AutoModelForCausalLM.from_pretrained(args.draft)
+
+    prompts = [
+        "I want you to act as a motivational coach. ",
+        "I want you to act as a travel guide. ",
+        "I want you to act as a storyteller. ",
+        "I want you to act as a Linux terminal. ",
+    ]
+    benchmark(SpeculativeDecoder(target_model, draft_model, tokenizer, k=args.k), prompts, args.max_new_tokens)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 병렬 · 재개 가능한 LoRA 스윕 러너
+#
+# 노트북의 `for R in LoRA_R_list:` 루프는 R 값마다 토크나이저, 모델, `load_dataset("jason9693/APEACH")`를
+# 다시 불러오며 순서대로 학습합니다. 이 스크립트는
+# - 기본 모델 가중치와 토크나이즈 캐시를 한 번만 디스크에 저장하고 (둘 다 mmap으로 공유)
+# - 워커 프로세스 풀에서 트라이얼을 병렬로 실행하며 (워커별 CPU 코어 고정 + 스레드 수 제한)
+# - 트라이얼 결과를 results_dir/<trial_id>.json 으로 저장해, 중단된 스윕을 다시 실행하면
+#   끝나지 않은 트라이얼만 이어서 실행합니다.
+#
+# 실행 예시:
+#
+#     python sweep.py rank --ranks 4 8 16 32 64 128 --workers 3 --threads-per-trial 4
+#     python sweep.py layer --r 4 --workers 4
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import torch
+
+import apeach_lora
+import cpu_training
+import token_cache
+
+
+def trial_id(config):
+    name = f"r{config['r']}"
+    if config.get("target_modules"):
+        name += "-" + config["target_modules"][0].replace(".", "_")
+    digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:8]
+    return f"{name}-{digest}"
+
+
+# 노트북의 R 값 스윕: 지원되는 모든 모듈에 LoRA 적용 (target_modules=None)
+def rank_sweep_trials(ranks, lora_alpha=32, lora_dropout=0.1):
+    return [{"r": r, "lora_alpha": lora_alpha, "lora_dropout": lora_dropout, "target_modules": None}
+            for r in ranks]
+
+
+# 노트북의 레이어별 스윕: R 고정, dense_layer_names 각각에 LoRA 적용
+# 노트북과 같이 max_length=128로 자른 입력을 쓰고, 레이어 순위는 macro F1(f1_metric.compute(average="macro"))로 매깁니다.
+def layer_sweep_trials(layer_names, r=4, lora_alpha=32, lora_dropout=0.1, max_length=128, metric="eval_f1_macro"):
+    return [{"r": r, "lora_alpha": lora_alpha, "lora_dropout": lora_dropout, "target_modules": [name],
+             "task_type": "SEQ_CLS", "max_length": max_length, "metric": metric}
+            for name in layer_names]
+
+
+def splits_file(cache_dir, max_length=None):
+    return os.path.join(cache_dir, "splits.json" if max_length is None else f"splits-{max_length}.json")
+
+
+# 기본 모델 가중치, 설정, 토크나이저와 토크나이즈 캐시(token_cache)를 cache_dir에 한 번만 저장합니다.
+# 토크나이즈 캐시는 max_length(자르기 길이, None이면 자르지 않음)마다 따로 만듭니다.
+def prepare_shared(cache_dir, model_name=apeach_lora.model_name, dataset_name=apeach_lora.dataset_name,
+                   max_length=None):
+    from datasets import load_dataset
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    weights_path = os.path.join(cache_dir, "base_weights.pt")
+    splits_path = splits_file(cache_dir, max_length)
+    if os.path.exists(weights_path) and os.path.exists(splits_path):
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if not os.path.exists(weights_path):
+        model = AutoModelForSequenceClassification.from_pretrained(model_name, num_labels=2)
+        model.config.save_pretrained(cache_dir)
+        # 모든 트라이얼이 같은 분류기 초기값에서 시작합니다.
+        torch.save(model.state_dict(), weights_path)
+
+    splits = token_cache.load_or_build(os.path.join(cache_dir, "tokens"), dataset_name, load_dataset(dataset_name),
+                                       tokenizer, text_column="text", label_column="class", max_length=max_length)
+    with open(splits_path, "w") as f:
+        json.dump({name: split.path for name, split in splits.items()}, f)
+
+
+# 워커에서 공유 자원을 불러옵니다.
+# 가중치는 mmap=True로 읽고 assign=True로 파라미터에 그대로 연결하므로, 고정된 기본 가중치는
+# 페이지 캐시를 통해 모든 워커가 공유합니다. (학습되는 분류기 페이지만 copy-on-write로 복사됩니다.)
+# 토크나이즈 캐시도 mmap으로 열기 때문에 워커끼리 공유됩니다.
+def load_shared(cache_dir, max_length=None):
+    from transformers import AutoConfig, AutoModelForSequenceClassification
+
+    config = AutoConfig.from_pretrained(cache_dir)
+    model = AutoModelForSequenceClassification.from_config(config)
+    state_dict = torch.load(os.path.join(cache_dir, "base_weights.pt"), mmap=True, weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    with open(splits_file(cache_dir, max_length)) as f:
+        splits = {name: token_cache.TokenizedSplit(path) for name, path in json.load(f).items()}
+    return model, splits
+
+
+# 워커 초기화: 코어 묶음 하나를 받아 해당 코어에 프로세스를 고정하고 스레드 수를 맞춥니다.
+def init_worker(core_queue):
+    cores = core_queue.get()
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(max(1, len(cores)) if cores else 1)
+    torch.set_num_interop_threads(1)
+
+
+def save_result(results_dir, result):
+    path = os.path.join(results_dir, f"{result['trial_id']}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_results(results_dir):
+    results = {}
+    if os.path.isdir(results_dir):
+        for filename in os.listdir(results_dir):
+            if filename.endswith(".json"):
+                with open(os.path.join(results_dir, filename)) as f:
+                    result = json.load(f)
+                results[result["trial_id"]] = result
+    return results
+
+
+# scheduler(asha.AshaScheduler)가 주어지면 매 에포크 결과를 보고하고, 하위 트라이얼은 조기 종료됩니다.
+# best_eval_f1은 config["metric"]에 적힌 history 항목(기본값 eval_f1, 양성 라벨 기준 F1)의 최댓값입니다.
+def run_trial(config, cache_dir, train_args, scheduler=None):
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    base_model, splits = load_shared(cache_dir, config.get("max_length"))
+    model = apeach_lora.build_lora_model(
+        base_model,
+        r=config["r"],
+        lora_alpha=config["lora_alpha"],
+        target_modules=config["target_modules"],
+        lora_dropout=config["lora_dropout"],
+        task_type=config.get("task_type"),
+    )
+    train_args = dict(train_args)
+    # CPU 학습 모드: 워커에 이미 맞춰 둔 스레드 수를 유지한 채 bf16 autocast / gradient checkpointing / LoRA 융합 적용
+    if train_args.pop("cpu_mode", False):
+        train_args["autocast_dtype"] = cpu_training.prepare_cpu_training(model, num_threads=torch.get_num_threads())
+    if "learning_rate" in config:
+        train_args["learning_rate"] = config["learning_rate"]
+    report = None
+    if scheduler is not None:
+        report = lambda epoch, history: scheduler.should_continue(trial_id(config), epoch, history)
+    history = apeach_lora.train_and_evaluate(model, splits, verbose=False, report=report, **train_args)
+    metric = config.get("metric", "eval_f1")
+    return {
+        "trial_id": trial_id(config),
+        "config": config,
+        "history": history,
+        "metric": metric,
+        "best_eval_f1": max(history[metric]),
+        "wall_time": time.perf_counter() - start,
+        "cpu_time": time.process_time() - cpu_start,
+        "epochs": len(history[metric]),
+        "finished_at": time.time(),
+    }
+
+
+# 아직 결과가 없는 트라이얼만 프로세스 풀에서 실행합니다.
+def run_sweep(trials, cache_dir, results_dir, workers=1, threads_per_trial=None, train_args=None, scheduler=None):
+    os.makedirs(results_dir, exist_ok=True)
+    results = load_results(results_dir)
+    pending = [config for config in trials if trial_id(config) not in results]
+    print(f"트라이얼 {len(trials)}개 중 완료 {len(trials) - len(pending)}개, 남은 트라이얼 {len(pending)}개")
+    if not pending:
+        return results
+
+    # 코어를 워커 수만큼 겹치지 않게 나눕니다.
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    threads_per_trial = threads_per_trial or max(1, len(cores) // workers)
+    context = multiprocessing.get_context("spawn")
+    core_queue = context.Queue()
+    for i in range(workers):
+        core_queue.put(cores[i * threads_per_trial:(i + 1) * threads_per_trial])
+
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(core_queue,)) as pool:
+        futures = {
+            pool.submit(run_trial, config, cache_dir, train_args or {}, scheduler): config for config in pending
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            save_result(results_dir, result)
+            results[result["trial_id"]] = result
+            print(f"[{result['trial_id']}] 최고 F1 점수 (검증, {result.get('metric', 'eval_f1')}): "
+                  f"{result['best_eval_f1']:.4f}, "
+                  f"에포크: {result['epochs']}, 소요 시간: {result['wall_time']:.0f}s")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["rank", "layer"])
+    parser.add_argument("--ranks", type=int, nargs="+", default=[4, 8, 16, 32, 64, 128])
+    parser.add_argument("--r", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-trial", type=int, default=None)
+    parser.add_argument("--num-epochs", type=int, default=apeach_lora.num_epochs)
+    parser.add_argument("--cpu-mode", action="store_true")
+    parser.add_argument("--cache-dir", default="./sweep_cache")
+    parser.add_argument("--results-dir", default=None)
+    args = parser.parse_args()
+
+    prepare_shared(args.cache_dir)
+    if args.mode == "rank":
+        trials = rank_sweep_trials(args.ranks)
+    else:
+        base_model, _ = load_shared(args.cache_dir)
+        trials = layer_sweep_trials(apeach_lora.dense_layer_names(base_model), r=args.r)
+    # 트라이얼이 쓰는 max_length마다 토크나이즈 캐시를 준비합니다.
+    for max_length in {config.get("max_length") for config in trials}:
+        prepare_shared(args.cache_dir, max_length=max_length)
+
+    results_dir = args.results_dir or f"./sweep_results/{args.mode}"
+    results = run_sweep(trials, args.cache_dir, results_dir, args.workers, args.threads_per_trial,
+                        {"num_epochs": args.num_epochs, "cpu_mode": args.cpu_mode})
+
+    for result in sorted(results.values(), key=lambda result: -result["best_eval_f1"]):
+        print(f"{result['trial_id']}: {result['best_eval_f1']:.4f} ({result.get('metric', 'eval_f1')})")
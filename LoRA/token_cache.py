@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # 토크나이즈 결과 캐시 + 길이 버킷 샘플러
+#
+# APEACH 노트북은 매 에포크, 매 배치마다 `tokenizer(batch['text'], padding=True, return_tensors='pt')`를
+# 다시 호출하고, Bloom 스크립트도 실행할 때마다 `data.map(... tokenizer ...)`를 다시 돌립니다.
+#
+# 이 모듈은 (데이터셋, 토크나이저, max_len) 조합마다 한 번만 토크나이즈해서
+# input_ids / attention_mask를 패딩 없이 이어붙인 1차원 NumPy 배열(.npy)로 저장하고,
+# 이후에는 mmap으로 읽기만 합니다. 길이가 비슷한 시퀀스끼리 배치를 만드는 LengthBucketSampler로
+# 패딩 낭비를 줄이고, 배치당 토큰 수와 패딩 비율을 집계합니다.
+#
+# Bloom 스크립트에서는 `data.map(...)` 대신 다음처럼 사용할 수 있습니다. (TokenizedSplit은 torch Dataset이므로
+# DataCollatorForLanguageModeling과 Trainer에 그대로 넘길 수 있습니다.)
+#
+#     splits = token_cache.load_or_build("./token_cache", dataset, data, tokenizer, text_column="prompt")
+#     train_sample = torch.utils.data.Subset(splits["train"], range(50))
+#
+# 실행 예시 (APEACH에서 무작위 배치와 길이 버킷 배치의 패딩 비율 비교):
+#
+#     python token_cache.py --model monologg/kobert --dataset jason9693/APEACH
+
+import argparse
+import hashlib
+import json
+import os
+import random
+
+import numpy as np
+import torch
+
+
+# 토크나이저를 구분하는 문자열 (이름, 클래스, 어휘 크기, fast 토크나이저라면 전체 설정의 해시)
+def tokenizer_fingerprint(tokenizer):
+    parts = [type(tokenizer).__name__, tokenizer.name_or_path, str(len(tokenizer))]
+    if hasattr(tokenizer, "backend_tokenizer"):
+        parts.append(hashlib.sha1(tokenizer.backend_tokenizer.to_str().encode()).hexdigest())
+    return "|".join(parts)
+
+
+def cache_key(dataset_name, split, dataset, tokenizer, max_length):
+    parts = [dataset_name, split, getattr(dataset, "_fingerprint", str(len(dataset))),
+             tokenizer_fingerprint(tokenizer), str(max_length)]
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()[:16]
+
+
+class TokenizedSplit(torch.utils.data.Dataset):
+    # 캐시 디렉터리 하나(= 한 split)를 mmap으로 엽니다.
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.input_ids = np.load(os.path.join(path, "input_ids.npy"), mmap_mode="r")
+        self.attention_mask = np.load(os.path.join(path, "attention_mask.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.lengths = np.diff(self.offsets)
+        labels_path = os.path.join(path, "labels.npy")
+        self.labels = np.load(labels_path) if os.path.exists(labels_path) else None
+        self.pad_token_id = self.meta["pad_token_id"]
+
+    def __len__(self):
+        return len(self.lengths)
+
+    # Trainer / DataCollator에서 바로 쓸 수 있도록 리스트 형태로 돌려줍니다.
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        item = {
+            "input_ids": self.input_ids[start:end].tolist(),
+            "attention_mask": self.attention_mask[start:end].tolist(),
+        }
+        if self.labels is not None:
+            item["labels"] = int(self.labels[index])
+        return item
+
+    # __getitem__ 결과 목록을 받아 배치 최대 길이로 오른쪽 패딩한 텐서를 만듭니다.
+    def collate(self, items):
+        max_len = max(len(item["input_ids"]) for item in items)
+        input_ids = np.full((len(items), max_len), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(items), max_len), dtype=np.int64)
+        for row, item in enumerate(items):
+            input_ids[row, :len(item["input_ids"])] = item["input_ids"]
+            attention_mask[row, :len(item["attention_mask"])] = item["attention_mask"]
+        batch = {"input_ids": torch.from_numpy(input_ids), "attention_mask": torch.from_numpy(attention_mask)}
+        if self.labels is not None:
+            batch["labels"] = torch.tensor([item["labels"] for item in items], dtype=torch.long)
+        return batch
+
+
+# 한 split을 토크나이즈해 평탄화된 배열로 저장합니다. 이미 있으면 다시 만들지 않습니다.
+def build_split(path, dataset, tokenizer, text_column, label_column=None, max_length=None, chunk_size=1000):
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return TokenizedSplit(path)
+
+    input_ids, attention_mask, lengths = [], [], []
+    for start in range(0, len(dataset), chunk_size):
+        texts = dataset[start:start + chunk_size][text_column]
+        encoded = tokenizer(texts, truncation=max_length is not None, max_length=max_length)
+        for ids, mask in zip(encoded["input_ids"], encoded["attention_mask"]):
+            input_ids.extend(ids)
+            attention_mask.extend(mask)
+            lengths.append(len(ids))
+
+    tmp_path = path + ".tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    dtype = np.int32 if len(tokenizer) < 2 ** 31 else np.int64
+    np.save(os.path.join(tmp_path, "input_ids.npy"), np.asarray(input_ids, dtype=dtype))
+    np.save(os.path.join(tmp_path, "attention_mask.npy"), np.asarray(attention_mask, dtype=np.uint8))
+    np.save(os.path.join(tmp_path, "offsets.npy"), np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+    if label_column is not None:
+        np.save(os.path.join(tmp_path, "labels.npy"), np.asarray(dataset[label_column], dtype=np.int64))
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"pad_token_id": pad_token_id, "num_tokens": len(input_ids), "max_length": max_length}, f)
+    os.replace(tmp_path, path)
+    return TokenizedSplit(path)
+
+
+# DatasetDict의 각 split을 캐시에서 읽거나, 없으면 만들어 {split: TokenizedSplit}으로 돌려줍니다.
+def load_or_build(cache_root, dataset_name, dataset, tokenizer, text_column="text", label_column=None,
+                  max_length=None):
+    splits = {}
+    for split in dataset:
+        key = cache_key(dataset_name, split, dataset[split], tokenizer, max_length)
+        path = os.path.join(cache_root, f"{split}-{key}")
+        splits[split] = build_split(path, dataset[split], tokenizer, text_column, label_column, max_length)
+    return splits
+
+
+class LengthBucketSampler(torch.utils.data.Sampler):
+    # 인덱스를 섞은 뒤 batch_size * bucket_multiplier 개씩 묶어 길이순으로 정렬하고,
+    # 그 안에서 배치를 잘라낸 다음 배치 순서를 다시 섞습니다.
+    # 데이터 병렬 학습에서는 모든 rank가 같은 seed로 같은 배치 목록을 만든 뒤 rank번째부터 num_replicas개 간격으로
+    # 나눠 가집니다. drop_uneven=True이면 rank마다 배치 수가 같도록 나머지 배치를 버립니다. (그래디언트 all-reduce 횟수 일치)
+    def __init__(self, lengths, batch_size, shuffle=True, bucket_multiplier=50, seed=0, num_replicas=1, rank=0,
+                 drop_uneven=False):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * bucket_multiplier
+        self.seed = seed
+        self.epoch = 0
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.drop_uneven = drop_uneven
+
+    def __len__(self):
+        num_batches = (len(self.lengths) + self.batch_size - 1) // self.batch_size
+        if self.drop_uneven:
+            return num_batches // self.num_replicas
+        return len(range(self.rank, num_batches, self.num_replicas))
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=lambda index: self.lengths[index])
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+        if self.shuffle:
+            rng.shuffle(batches)
+        if self.drop_uneven:
+            batches = batches[:len(batches) - len(batches) % self.num_replicas]
+        return iter(batches[self.rank::self.num_replicas])
+
+
+class PaddingStats:
+    def __init__(self):
+        self.batches = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def update(self, batch):
+        self.batches += 1
+        self.real_tokens += int(batch["attention_mask"].sum())
+        self.padded_tokens += batch["attention_mask"].numel()
+
+    @property
+    def tokens_per_batch(self):
+        return self.real_tokens / max(1, self.batches)
+
+    @property
+    def padding_ratio(self):
+        return 1 - self.real_tokens / max(1, self.padded_tokens)
+
+    def __str__(self):
+        return f"배치당 토큰: {self.tokens_per_batch:.1f}, 패딩 비율: {self.padding_ratio:.1%}"
+
+
+# num_replicas / rank를 주면 데이터 병렬 학습용으로 rank별 배치만 돌려줍니다. (distributed.py 참고)
+def make_dataloader(split, batch_size, shuffle=True, bucketed=True, seed=0, num_replicas=1, rank=0,
+                    drop_uneven=False):
+    if bucketed:
+        batch_sampler = LengthBucketSampler(split.lengths, batch_size, shuffle=shuffle, seed=seed,
+                                            num_replicas=num_replicas, rank=rank, drop_uneven=drop_uneven)
+    else:
+        if num_replicas > 1:
+            sampler = torch.utils.data.distributed.DistributedSampler(split, num_replicas, rank, shuffle=shuffle,
+                                                                      seed=seed, drop_last=drop_uneven)
+        elif shuffle:
+            sampler = torch.utils.data.RandomSampler(split)
+        else:
+            sampler = torch.utils.data.SequentialSampler(split)
+        batch_sampler = torch.utils.data.BatchSampler(sampler, batch_size, drop_last=False)
+    return torch.utils.data.DataLoader(split, batch_sampler=batch_sampler, collate_fn=split.collate)
+
+
+if __name__ == "__main__":
+    from datasets import load_dataset
+    from transformers import AutoTokenizer
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="monologg/kobert")
+    parser.add_argument("--dataset", default="jason9693/APEACH")
+    parser.add_argument("--text-column", default="text")
+    parser.add_argument("--label-column", default="class")
+    parser.add_argument("--max-length", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--cache-dir", default="./token_cache")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    splits = load_or_build(args.cache_dir, args.dataset, load_dataset(args.dataset), tokenizer,
+                           args.text_column, args.label_column, args.max_length)
+    for name, split in splits.items():
+        for bucketed in [False, True]:
+            stats = PaddingStats()
+            for batch in make_dataloader(split, args.batch_size, bucketed=bucketed):
+                stats.update(batch)
+            print(f"[{name}] {'길이 버킷' if bucketed else '무작위 배치'} - {stats}")